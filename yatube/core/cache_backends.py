@@ -0,0 +1,239 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY,'
+    ' value,'
+    ' size INTEGER NOT NULL,'
+    ' expires REAL,'
+    ' accessed REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_totals ('
+    ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+    ' entries INTEGER NOT NULL,'
+    ' size INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO cache_totals VALUES (1, 0, 0)',
+    'CREATE TRIGGER IF NOT EXISTS cache_inserted AFTER INSERT ON cache '
+    'BEGIN UPDATE cache_totals '
+    'SET entries = entries + 1, size = size + NEW.size; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_deleted AFTER DELETE ON cache '
+    'BEGIN UPDATE cache_totals '
+    'SET entries = entries - 1, size = size - OLD.size; END',
+)
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite в режиме WAL, общий для всех процессов хоста.
+
+    В отличие от LocMemCache каждый воркер видит одни и те же записи,
+    а инвалидация в одном процессе сразу видна остальным. Целые числа
+    в пределах 64 бит хранятся как INTEGER, остальные значения — pickle;
+    incr() читает и пишет значение в одной транзакции BEGIN IMMEDIATE.
+    Число записей и их размер ведут триггеры в cache_totals;
+    вытеснение — по давности доступа (LRU) при превышении MAX_ENTRIES
+    или MAX_SIZE байт. Время доступа обновляется не чаще, чем раз в
+    ACCESS_RESOLUTION секунд, чтобы чтения не превращались в записи.
+    """
+
+    access_resolution = 10
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self.access_resolution = options.get(
+            'ACCESS_RESOLUTION', self.access_resolution)
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # Соединение своё у каждого потока и у каждого процесса после fork
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self._path, timeout=30,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            # REPLACE должен вызывать триггер удаления старой строки
+            db.execute('PRAGMA recursive_triggers=ON')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @staticmethod
+    def _encode(value):
+        # Большее целое не влезет в INTEGER SQLite
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return value, 8
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return data, len(data)
+
+    @staticmethod
+    def _decode(value):
+        return value if isinstance(value, int) else pickle.loads(value)
+
+    def _write(self, statements):
+        """Выполняет (sql, params) одной транзакцией BEGIN IMMEDIATE."""
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            results = [db.execute(sql, params).rowcount
+                       for sql, params in statements]
+            self._cull(db)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return results
+
+    def _store(self, key, value, timeout, only_new=False):
+        data, size = self._encode(value)
+        now = time.time()
+        statements = [
+            ('DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now)),
+        ] if only_new else []
+        verb = 'INSERT OR IGNORE' if only_new else 'INSERT OR REPLACE'
+        statements.append((
+            f'{verb} INTO cache (key, value, size, expires, accessed) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, data, size, self.get_backend_timeout(timeout), now),
+        ))
+        return statements
+
+    def _over_limits(self, db):
+        entries, size = db.execute(
+            'SELECT entries, size FROM cache_totals').fetchone()
+        if entries <= self._max_entries and size <= self._max_size:
+            return 0
+        return entries
+
+    def _cull(self, db):
+        if not self._over_limits(db):
+            return
+        db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        entries = self._over_limits(db)
+        if not entries:
+            return
+        # Удаляем 1/CULL_FREQUENCY записей, начиная с давно не читанных
+        evict = (entries // self._cull_frequency
+                 if self._cull_frequency else entries)
+        db.execute(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+            (max(evict, 1),))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        statements = self._store(key, value, timeout, only_new=True)
+        return self._write(statements)[-1] == 1
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        made = {self.make_key(key, version=version): key for key in keys}
+        for key in made:
+            self.validate_key(key)
+        if not made:
+            return {}
+        now = time.time()
+        placeholders = ', '.join('?' * len(made))
+        rows = self._db.execute(
+            f'SELECT key, value, accessed FROM cache '
+            f'WHERE key IN ({placeholders}) '
+            f'AND (expires IS NULL OR expires > ?)',
+            (*made, now),
+        ).fetchall()
+        stale = [key for key, _, accessed in rows
+                 if accessed < now - self.access_resolution]
+        if stale:
+            self._db.execute(
+                f'UPDATE cache SET accessed = ? '
+                f'WHERE key IN ({", ".join("?" * len(stale))})',
+                (now, *stale))
+        return {made[key]: self._decode(value) for key, value, _ in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._write(self._store(key, value, timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        statements = []
+        for key, value in data.items():
+            key = self.make_key(key, version=version)
+            self.validate_key(key)
+            statements += self._store(key, value, timeout)
+        if statements:
+            self._write(statements)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        cursor = self._db.execute(
+            'UPDATE cache SET expires = ? '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()))
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT value FROM cache '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (key, time.time())).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = self._decode(row[0]) + delta
+            # Сумма может выйти за 64 бита: тогда она уходит в pickle,
+            # а REPLACE через триггеры поправит размер в cache_totals
+            data, size = self._encode(value)
+            db.execute(
+                'INSERT OR REPLACE INTO cache '
+                '(key, value, size, expires, accessed) '
+                'SELECT key, ?, ?, expires, accessed FROM cache '
+                'WHERE key = ?', (data, size, key))
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return value
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._db.execute(
+            'SELECT 1 FROM cache '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time())).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+        if keys:
+            placeholders = ', '.join('?' * len(keys))
+            self._db.execute(
+                f'DELETE FROM cache WHERE key IN ({placeholders})', keys)
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
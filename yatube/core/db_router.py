@@ -0,0 +1,102 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.migrations.recorder import MigrationRecorder
+
+PIN_KEY = 'primary_until'
+
+_state = threading.local()
+_schema = {'checked': float('-inf'), 'matches': False}
+
+
+def read_replica(view_func):
+    """Декоратор view: GET-запрос читает с реплики."""
+    view_func.read_replica = True
+    return view_func
+
+
+def _applied(alias):
+    try:
+        return set(MigrationRecorder(connections[alias]).applied_migrations())
+    except DatabaseError:
+        return None
+
+
+def replica_schema_matches():
+    """В реплике применены те же миграции, что и в основной базе.
+
+    После деплоя с новыми миграциями схема реплики старая, пока её не
+    обновит sync_replica, — до тех пор чтения идут в основную базу.
+    Ответ процесс помнит REPLICA_SCHEMA_CHECK_SECONDS секунд.
+    """
+    now = time.monotonic()
+    if now - _schema['checked'] >= settings.REPLICA_SCHEMA_CHECK_SECONDS:
+        replica = _applied(settings.DATABASE_REPLICA)
+        _schema['matches'] = (replica is not None
+                              and replica == _applied(DEFAULT_DB_ALIAS))
+        _schema['checked'] = now
+    return _schema['matches']
+
+
+class PrimaryReplicaRouter:
+    """Чтения запроса с @read_replica идут в DATABASE_REPLICA.
+
+    Всё остальное, включая любые записи, — в основную базу. После
+    первой записи запрос до конца читает с основной базы: свои
+    изменения видны сразу, даже если реплика отстаёт.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (getattr(_state, 'replica', False)
+                and not getattr(_state, 'wrote', False)):
+            return settings.DATABASE_REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # В реплике те же строки, что и в основной базе
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплика — копия основной базы целиком, схема приходит с ней
+        if db == settings.DATABASE_REPLICA:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """Включает чтение с реплики для view с @read_replica.
+
+    Сессия, которая только что писала, REPLICA_PIN_SECONDS секунд
+    читает с основной базы: автор сразу видит свой пост в ленте.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica = _state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _state.wrote
+        finally:
+            _state.replica = _state.wrote = False
+        user = getattr(request, 'user', None)
+        if (wrote and settings.REPLICA_READS
+                and user is not None and user.is_authenticated):
+            request.session[PIN_KEY] = (
+                time.time() + settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (settings.REPLICA_READS
+                and getattr(view_func, 'read_replica', False)
+                and request.method in ('GET', 'HEAD')
+                and request.session.get(PIN_KEY, 0) < time.time()
+                and replica_schema_matches()):
+            _state.replica = True
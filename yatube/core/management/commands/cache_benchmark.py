@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = (
+    ('locmem', 'django.core.cache.backends.locmem.LocMemCache'),
+    ('sqlite', 'core.cache_backends.SQLiteCache'),
+)
+
+
+def run_worker(backend, location, ops, keys, seed, results):
+    """Один воркер: читает ключи с перекосом к «горячим», промах дописывает."""
+    cache = import_string(backend)(
+        location, {'TIMEOUT': None, 'OPTIONS': {'MAX_ENTRIES': keys * 2}})
+    rnd = random.Random(seed)
+    payload = 'x' * 512
+    hits = 0
+    started = time.perf_counter()
+    for _ in range(ops):
+        key = f'bench:{int(keys * rnd.random() ** 2)}'
+        if cache.get(key) is None:
+            cache.set(key, payload)
+        else:
+            hits += 1
+    results.put((hits, time.perf_counter() - started))
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает LocMemCache и SQLiteCache при нескольких процессах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--ops', type=int, default=5000,
+                            help='Операций на воркер')
+        parser.add_argument('--keys', type=int, default=1000,
+                            help='Размер пространства ключей')
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as directory:
+            for name, backend in BACKENDS:
+                location = os.path.join(directory, f'{name}.sqlite3')
+                results = context.Queue()
+                workers = [
+                    context.Process(target=run_worker, args=(
+                        backend, location, options['ops'],
+                        options['keys'], seed, results))
+                    for seed in range(options['workers'])
+                ]
+                for worker in workers:
+                    worker.start()
+                outcomes = [results.get() for _ in workers]
+                for worker in workers:
+                    worker.join()
+                total = options['ops'] * options['workers']
+                hits = sum(hits for hits, _ in outcomes)
+                elapsed = max(seconds for _, seconds in outcomes)
+                self.stdout.write(
+                    f'{name:>6}: {options["workers"]} воркеров, '
+                    f'{total / elapsed:,.0f} оп/с, '
+                    f'попаданий {hits / total:.1%}')
@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max
+from django.db.utils import OperationalError
+from django.utils import timezone
+
+from core.models import ReplicaHeartbeat
+
+
+class Command(BaseCommand):
+    help = 'Показывает, насколько реплика отстаёт от основной базы'
+
+    def handle(self, *args, **options):
+        replica = settings.DATABASE_REPLICA
+        try:
+            heartbeat = ReplicaHeartbeat.objects.using(replica).first()
+        except OperationalError:
+            heartbeat = None
+        if heartbeat is None:
+            raise CommandError('Реплика пуста: запустите sync_replica')
+        lag = (timezone.now() - heartbeat.at).total_seconds()
+        self.stdout.write(f'Отставание реплики: {lag:.1f} с')
+        Post = apps.get_model('posts', 'Post')
+        latest = {alias: Post.objects.using(alias).aggregate(
+            pk=Max('pk'), updated=Max('updated'))
+            for alias in (DEFAULT_DB_ALIAS, replica)}
+        primary, copy = latest[DEFAULT_DB_ALIAS], latest[replica]
+        behind = Post.objects.filter(pk__gt=copy['pk'] or 0).count()
+        self.stdout.write(f'Новых постов нет в реплике: {behind}')
+        if primary['updated'] and copy['updated']:
+            stale = (primary['updated'] - copy['updated']).total_seconds()
+            self.stdout.write(
+                f'Последняя правка поста в реплике старее на {stale:.1f} с')
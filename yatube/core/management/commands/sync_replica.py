@@ -0,0 +1,45 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from core.models import ReplicaHeartbeat
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в реплику через backup API; '
+            'с --interval повторяет копирование, как поток репликации')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые столько секунд')
+        parser.add_argument('--pages', type=int, default=256,
+                            help='Страниц за шаг: между шагами читатели '
+                                 'реплики не ждут')
+
+    def handle(self, *args, **options):
+        for alias in (DEFAULT_DB_ALIAS, settings.DATABASE_REPLICA):
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError('Реплика-заглушка только для SQLite')
+        while True:
+            started = time.monotonic()
+            self.sync(options['pages'])
+            self.stdout.write(
+                f'Реплика обновлена за '
+                f'{time.monotonic() - started:.2f} с')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    @staticmethod
+    def sync(pages):
+        ReplicaHeartbeat.objects.update_or_create(
+            pk=1, defaults={'at': timezone.now()})
+        primary = connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        replica = connections[settings.DATABASE_REPLICA].settings_dict['NAME']
+        with sqlite3.connect(primary) as source, \
+                sqlite3.connect(replica, timeout=30) as target:
+            source.backup(target, pages=pages, sleep=0.01)
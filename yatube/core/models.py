@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class ReplicaHeartbeat(models.Model):
+    """Метка времени, которую sync_replica пишет перед копированием.
+
+    В реплику она попадает вместе с данными, поэтому её возраст в
+    реплике — это её отставание (manage.py replica_lag).
+    """
+    at = models.DateTimeField('Время копирования')
+
+    class Meta:
+        verbose_name = 'Метка репликации'
+        verbose_name_plural = 'Метки репликации'
+
+    def __str__(self):
+        return f'{self.at:%Y-%m-%d %H:%M:%S}'
@@ -0,0 +1,149 @@
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import (ManifestStaticFilesStorage,
+                                                staticfiles_storage)
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Какие файлы имеет смысл сжимать: картинки и шрифты уже сжаты
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ico', '.txt', '.map', '.json',
+                '.html', '.xml')
+# Сжатая копия хранится, только если заметно меньше оригинала
+MIN_RATIO = 0.95
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def _compressors():
+    yield '.gz', lambda data: gzip.compress(data, 9, mtime=0)
+    if brotli is not None:
+        yield '.br', brotli.compress
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Статика с хешем в имени и заранее сжатыми копиями.
+
+    collectstatic кладёт рядом с каждым css/js/… файл .gz, а если
+    установлен brotli — и .br; StaticFilesMiddleware отдаёт их по
+    Accept-Encoding. Без манифеста (collectstatic не запускали)
+    {% static %} отдаёт имя без хеша, а не падает.
+    """
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if hashed_name and not dry_run:
+                self.compress(hashed_name)
+            yield name, hashed_name, processed
+
+    def compress(self, name):
+        if not name.endswith(COMPRESSIBLE):
+            return
+        with self.open(name) as original:
+            data = original.read()
+        for extension, compress in _compressors():
+            compressed = compress(data)
+            if len(compressed) < len(data) * MIN_RATIO:
+                with open(self.path(name) + extension, 'wb') as target:
+                    target.write(compressed)
+
+    def immutable(self, name):
+        """Имя с хешем из манифеста: файл по нему никогда не меняется."""
+        if not hasattr(self, '_immutable'):
+            self._immutable = set(self.hashed_files.values())
+        return name in self._immutable
+
+
+def accepted_encodings(request):
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00'):
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+class StaticFilesMiddleware:
+    """Отдаёт собранную collectstatic статику из STATIC_ROOT.
+
+    Предпочитает .br или .gz копию, если клиент её принимает; файлам
+    с хешем в имени ставит Cache-Control на год с immutable.
+    Файлов, которых нет в STATIC_ROOT, не касается: в разработке их
+    отдаёт runserver.
+    """
+    ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if (request.method in ('GET', 'HEAD') and settings.STATIC_ROOT
+                and request.path.startswith(settings.STATIC_URL)):
+            response = self.serve(request,
+                                  request.path[len(settings.STATIC_URL):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+        content_type, _ = mimetypes.guess_type(path)
+        accepted = accepted_encodings(request)
+        encoding = None
+        for coding, extension in self.ENCODINGS:
+            if coding in accepted and os.path.isfile(path + extension):
+                encoding, path = coding, path + extension
+                break
+        response = FileResponse(
+            open(path, 'rb'),
+            content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if name.endswith(COMPRESSIBLE):
+            response['Vary'] = 'Accept-Encoding'
+        if staticfiles_storage.immutable(name):
+            response['Cache-Control'] = IMMUTABLE
+        else:
+            response['Cache-Control'] = 'public, max-age=60'
+        return response
+
+
+class PreloadLinkMiddleware:
+    """Заголовок Link: preload для критичной статики из STATIC_PRELOAD.
+
+    Браузер начинает загрузку CSS, ещё не разобрав <head>. Стоит снаружи
+    кэша страниц, поэтому заголовок есть и у ответов из кэша.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (response.status_code == 200
+                and response.get('Content-Type', '').startswith('text/html')):
+            links = [f'<{staticfiles_storage.url(name)}>; rel=preload; '
+                     f'as={kind}' for name, kind in settings.STATIC_PRELOAD]
+            if links:
+                response['Link'] = ', '.join(links)
+        return response
@@ -0,0 +1,276 @@
+import gzip
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.db import connections, router
+from django.db.migrations.recorder import MigrationRecorder
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+
+from .cache_backends import SQLiteCache
+from .db_router import PIN_KEY, ReplicaMiddleware, read_replica
+from .query_budget import (QueryBudgetExceeded, QueryBudgetMiddleware,
+                           query_budget)
+
+User = get_user_model()
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    """Общий для процессов кэш на SQLite"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_values_shared_between_instances(self):
+        """Запись одного экземпляра (воркера) видна другому."""
+        self.cache.set('key', {'posts': [1, 2]})
+        self.assertEqual(self.make_cache().get('key'), {'posts': [1, 2]})
+        self.make_cache().delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_add_and_expiry(self):
+        """add() не перезаписывает живой ключ, истёкший — перезаписывает."""
+        self.assertTrue(self.cache.add('key', 'first'))
+        self.assertFalse(self.cache.add('key', 'second'))
+        self.cache.set('old', 'value', timeout=0)
+        self.assertIsNone(self.cache.get('old'))
+        self.assertTrue(self.cache.add('old', 'fresh'))
+        self.assertEqual(self.cache.get('old'), 'fresh')
+
+    def test_incr_is_shared(self):
+        """incr() меняет одно значение для всех экземпляров."""
+        self.cache.set('generation', 1)
+        self.assertEqual(self.make_cache().incr('generation'), 2)
+        self.assertEqual(self.cache.incr('generation', 5), 7)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_ints_beyond_64_bits(self):
+        """Целые вне INTEGER SQLite хранятся и прибавляются без ошибок."""
+        self.cache.set('huge', 2 ** 70)
+        self.assertEqual(self.cache.get('huge'), 2 ** 70)
+        self.assertEqual(self.cache.incr('huge', -1), 2 ** 70 - 1)
+        self.cache.set('edge', 2 ** 63 - 1)
+        self.assertEqual(self.make_cache().incr('edge'), 2 ** 63)
+        self.assertEqual(self.cache.get('edge'), 2 ** 63)
+        self.assertEqual(self.cache.incr('edge', -2), 2 ** 63 - 2)
+        self.assertEqual(self.cache.incr('edge', -2 ** 64), -2 ** 63 - 2)
+
+    def test_lru_eviction(self):
+        """При переполнении вытесняются давно не читанные ключи."""
+        cache = self.make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3,
+                                ACCESS_RESOLUTION=0)
+        for number in range(3):
+            cache.set(f'key{number}', number)
+        cache.get('key0')
+        cache.set('key3', 3)
+        self.assertEqual(
+            cache.get_many(['key0', 'key1', 'key2', 'key3']),
+            {'key0': 0, 'key2': 2, 'key3': 3})
+
+    def test_size_cap(self):
+        """Суммарный размер значений не превышает MAX_SIZE надолго."""
+        cache = self.make_cache(MAX_SIZE=4096, CULL_FREQUENCY=2)
+        for number in range(20):
+            cache.set(f'key{number}', 'x' * 1000)
+        stored = cache.get_many([f'key{number}' for number in range(20)])
+        self.assertLessEqual(len(stored) * 1000, 4096 + 1000)
+        self.assertIn('key19', stored)
+
+
+class QueryBudgetMiddlewareTest(TestCase):
+    """Бюджет SQL-запросов view"""
+    def run_view(self, budget):
+        def view(request):
+            User.objects.exists()
+            User.objects.exists()
+            return HttpResponse()
+
+        middleware = QueryBudgetMiddleware(view)
+        request = RequestFactory().get('/')
+        middleware.process_view(request, query_budget(budget)(view), (), {})
+        return middleware(request)
+
+    def test_counts_queries(self):
+        response = self.run_view(2)
+        self.assertEqual(response.query_count, 2)
+
+    @override_settings(QUERY_BUDGET_RAISE=True)
+    def test_raises_over_budget_when_enabled(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.run_view(1)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_logs_over_budget_by_default(self):
+        with self.assertLogs('core.query_budget', 'WARNING'):
+            self.run_view(1)
+
+
+class StaticPipelineTest(SimpleTestCase):
+    """Статика с хешем в имени, сжатыми копиями и preload"""
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.settings = override_settings(STATIC_ROOT=cls.root)
+        cls.settings.enable()
+        super().setUpClass()
+        call_command('collectstatic', interactive=False, verbosity=0,
+                     stdout=StringIO())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings.disable()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.url = staticfiles_storage.url('css/bootstrap.min.css')
+        with open(os.path.join(settings.BASE_DIR, 'static', 'css',
+                               'bootstrap.min.css'), 'rb') as original:
+            self.original = original.read()
+
+    def test_hashed_name_has_compressed_sibling(self):
+        self.assertRegex(self.url, r'/css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.root, self.url[len(settings.STATIC_URL):])
+            + '.gz'))
+
+    def test_gzip_served_when_accepted(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)),
+            self.original)
+
+    def test_plain_served_without_accept_encoding(self):
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.original)
+
+    def test_unhashed_name_is_not_immutable(self):
+        response = self.client.get('/static/css/bootstrap.min.css',
+                                   HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_pages_preload_critical_css(self):
+        response = self.client.get('/about/author/')
+        self.assertEqual(response['Link'],
+                         f'<{self.url}>; rel=preload; as=style')
+
+
+class SQLitePragmasTest(SimpleTestCase):
+    """Каждое соединение SQLite получает профиль SQLITE_PRAGMAS"""
+    def test_new_connection_uses_production_profile(self):
+        directory = tempfile.mkdtemp()
+        default = connections['default']
+        wrapper = type(default)(
+            {**default.settings_dict,
+             'NAME': os.path.join(directory, 'db.sqlite3')}, 'pragmas')
+        wrapper.force_debug_cursor = True
+        try:
+            with wrapper.cursor() as cursor:
+                for pragma, value in (('journal_mode', 'wal'),
+                                      ('synchronous', 1),
+                                      ('busy_timeout', 5000),
+                                      ('temp_store', 2)):
+                    cursor.execute(f'PRAGMA {pragma}')
+                    self.assertEqual(cursor.fetchone()[0], value, pragma)
+                # PRAGMA прошли мимо курсора Django
+                self.assertEqual(len(wrapper.queries_log), 4)
+        finally:
+            wrapper.close()
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+@override_settings(REPLICA_READS=True, REPLICA_SCHEMA_CHECK_SECONDS=0)
+class ReplicaRouterTest(SimpleTestCase):
+    """Чтения с реплики, записи и свежие сессии — с основной базы"""
+    def setUp(self):
+        self.applied = {'default': {('posts', '0001_initial')},
+                        'replica': {('posts', '0001_initial')}}
+        patcher = mock.patch.object(
+            MigrationRecorder, 'applied_migrations', autospec=True,
+            side_effect=lambda recorder: self.applied[
+                recorder.connection.alias])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_view(self, view, user=None, method='get', session=None):
+        request = getattr(RequestFactory(), method)('/')
+        request.session = SessionStore()
+        request.session.update(session or {})
+        request.user = user or AnonymousUser()
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            seen.extend(view(request))
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(get_response)
+        middleware(request)
+        return seen, request
+
+    @staticmethod
+    def reads(request):
+        return [router.db_for_read(User)]
+
+    def test_read_view_uses_replica(self):
+        seen, _ = self.run_view(read_replica(self.reads))
+        self.assertEqual(seen, ['replica'])
+        # Вне запроса — снова основная база
+        self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_other_views_and_methods_use_primary(self):
+        self.assertEqual(self.run_view(self.reads)[0], ['default'])
+        self.assertEqual(
+            self.run_view(read_replica(self.reads), method='post')[0],
+            ['default'])
+        with self.settings(REPLICA_READS=False):
+            self.assertEqual(
+                self.run_view(read_replica(self.reads))[0], ['default'])
+
+    def test_write_switches_request_to_primary_and_pins_session(self):
+        @read_replica
+        def view(request):
+            before = router.db_for_read(User)
+            self.assertEqual(router.db_for_write(User), 'default')
+            return [before, router.db_for_read(User)]
+
+        user = User(username='writer')
+        seen, request = self.run_view(view, user=user)
+        self.assertEqual(seen, ['replica', 'default'])
+        self.assertIn(PIN_KEY, request.session)
+        seen, _ = self.run_view(read_replica(self.reads), user=user,
+                                session=dict(request.session.items()))
+        self.assertEqual(seen, ['default'])
+
+    def test_replica_with_old_migrations_is_skipped(self):
+        """После деплоя с новыми миграциями чтения — с основной базы"""
+        self.applied['default'].add(('posts', '0002_new'))
+        self.assertEqual(
+            self.run_view(read_replica(self.reads))[0], ['default'])
+        self.applied['replica'].add(('posts', '0002_new'))
+        self.assertEqual(
+            self.run_view(read_replica(self.reads))[0], ['replica'])
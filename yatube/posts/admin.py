@@ -1,6 +1,8 @@
 from django.contrib import admin
+from django.db.models.expressions import RawSQL
 
-from .models import Post, Group, Follow, Comment
+from .models import ArchivedPost, Post, Group, Follow, Comment
+from .search import build_match, matching_ids_sql
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -10,6 +12,18 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Ищет по индексу FTS5 вместо LIKE '%...%' по всей таблице."""
+        match = build_match(search_term)
+        if not match:
+            return queryset, False
+        ids = RawSQL(*matching_ids_sql(match))
+        return queryset.filter(pk__in=ids), False
+
+
+class ArchivedPostAdmin(PostAdmin):
+    list_editable = ()
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('title', 'slug', 'description')
@@ -26,6 +40,7 @@ class CommentAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Post, PostAdmin)
+admin.site.register(ArchivedPost, ArchivedPostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(Comment, CommentAdmin)
@@ -0,0 +1,114 @@
+import ctypes
+import mmap
+import os
+
+from django.db import connection, transaction
+
+from . import feed_cache
+from .models import (ArchivedComment, ArchivedPost, Comment, Post,
+                     TimelineEntry)
+
+POST_COLUMNS = 'id, text, pub_date, updated, author_id, group_id, image'
+COMMENT_COLUMNS = 'id, post_id, author_id, text, created'
+
+
+def candidates(cutoff):
+    """Посты старше cutoff, самые старые первыми."""
+    return Post.objects.filter(pub_date__lt=cutoff).order_by('pub_date', 'pk')
+
+
+def move_batch(cutoff, batch):
+    """Переносит в архив до batch самых старых постов вместе с
+    комментариями, возвращает id перенесённых.
+
+    Строки копируются INSERT … SELECT и удаляются в одной транзакции.
+    Сигналы удаления Post не срабатывают: пост не исчез, поэтому
+    счётчики, поисковый индекс и ссылки на картинки остаются как были.
+    Строки лент подписок удаляются: лента продолжается в архиве.
+    """
+    with transaction.atomic():
+        ids = list(candidates(cutoff).values_list('pk', flat=True)[:batch])
+        if not ids:
+            return []
+        marks = ', '.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {ArchivedPost._meta.db_table} ({POST_COLUMNS}) '
+                f'SELECT {POST_COLUMNS} FROM {Post._meta.db_table} '
+                f'WHERE id IN ({marks})', ids)
+            cursor.execute(
+                f'INSERT INTO {ArchivedComment._meta.db_table} '
+                f'({COMMENT_COLUMNS}) SELECT {COMMENT_COLUMNS} '
+                f'FROM {Comment._meta.db_table} WHERE post_id IN ({marks})',
+                ids)
+            for model, column in ((TimelineEntry, 'post_id'),
+                                  (Comment, 'post_id'), (Post, 'id')):
+                cursor.execute(
+                    f'DELETE FROM {model._meta.db_table} '
+                    f'WHERE {column} IN ({marks})', ids)
+    # Страница поста теперь без формы комментария и ссылки на правку
+    feed_cache.bump(*(f'post:{pk}' for pk in ids))
+    return ids
+
+
+def resident_pages(path):
+    """Флаги «страница файла в page cache ОС» по страницам ОС.
+
+    None, если база не в файле или mincore недоступен на этой платформе.
+    """
+    if not os.path.isfile(path):
+        return None
+    size = os.path.getsize(path)
+    if not size:
+        return []
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                              ctypes.c_int, ctypes.c_int, ctypes.c_long)
+        libc.mincore.argtypes = (ctypes.c_void_p, ctypes.c_size_t,
+                                 ctypes.c_void_p)
+        libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+    except (AttributeError, OSError):
+        return None
+    pages = (ctypes.c_ubyte * -(-size // mmap.PAGESIZE))()
+    with open(path, 'rb') as database:
+        address = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED,
+                            database.fileno(), 0)
+    if address in (None, ctypes.c_void_p(-1).value):
+        return None
+    try:
+        if libc.mincore(address, size, pages) != 0:
+            return None
+    finally:
+        libc.munmap(address, size)
+    return [bool(flag & 1) for flag in pages]
+
+
+def table_report(model):
+    """Размер таблицы модели и её индексов и их доля в page cache ОС.
+
+    Строка на объект SQLite: (имя, страниц, байт, страниц в кэше или
+    None). Страницы, ещё не перенесённые из WAL в основной файл,
+    считаются по их старой копии.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT name, pageno FROM dbstat WHERE name IN '
+            '(SELECT name FROM sqlite_master WHERE tbl_name = %s) '
+            'ORDER BY name', [table])
+        rows = cursor.fetchall()
+    flags = resident_pages(connection.settings_dict['NAME'])
+    objects = {}
+    for name, pageno in rows:
+        counts = objects.setdefault(name, [0, 0])
+        counts[0] += 1
+        offset = (pageno - 1) * page_size // mmap.PAGESIZE
+        if flags is not None and offset < len(flags) and flags[offset]:
+            counts[1] += 1
+    return [(name, pages, pages * page_size,
+             None if flags is None else resident)
+            for name, (pages, resident) in objects.items()]
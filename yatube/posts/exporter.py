@@ -0,0 +1,140 @@
+import gzip
+import json
+import os
+from contextlib import contextmanager
+
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow, Group,
+                     Post, Tombstone)
+
+# Поля выгрузки в формате import_yatube: ссылки — по username и slug.
+# id идёт первым: по нему продолжается keyset-проход
+FIELDS = {
+    'groups': {'id': 'pk', 'slug': 'slug', 'title': 'title',
+               'description': 'description'},
+    'posts': {'id': 'pk', 'author': 'author__username',
+              'group': 'group__slug', 'text': 'text', 'pub_date': 'pub_date',
+              'updated': 'updated', 'image': 'image'},
+    'comments': {'id': 'pk', 'post': 'post_id', 'author': 'author__username',
+                 'text': 'text', 'created': 'created'},
+    'follows': {'id': 'pk', 'user': 'user__username',
+                'author': 'author__username'},
+}
+# Таблицы каждой выгрузки: посты и комментарии — вместе с архивом
+SOURCES = {
+    'groups': (Group,),
+    'posts': (Post, ArchivedPost),
+    'comments': (Comment, ArchivedComment),
+    'follows': (Follow,),
+}
+# Поле даты, по которому инкрементальная выгрузка берёт изменения.
+# У подписок даты нет, но они не меняются: водяной знак — последний id.
+# Группы маленькие и правятся, они выгружаются целиком
+CHANGED = {'posts': 'updated', 'comments': 'created'}
+APPEND_ONLY = ('follows',)
+# Выгрузки, удаления из которых отмечает Tombstone; группы и так
+# выгружаются целиком. Перенос поста в архив — не удаление: строка
+# с тем же id и теми же данными остаётся, import_yatube сам раскладывает
+# посты по таблицам по дате
+DELETED = ('posts', 'comments', 'follows')
+TOMBSTONE_FIELDS = {'tombstone': 'pk', 'id': 'object_id',
+                    'deleted': 'deleted'}
+
+# Однократному проходу по таблице большой кэш страниц и mmap из
+# SQLITE_PRAGMAS не помогают, а память процесса растёт до их предела
+SCAN_PRAGMAS = {'cache_size': -2000, 'mmap_size': 0}
+
+
+@contextmanager
+def scan_pragmas(connection):
+    """Кэш страниц SQLite по умолчанию на время выгрузки."""
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        saved = {}
+        for name, value in SCAN_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            # База в памяти не отвечает на mmap_size
+            if row is not None:
+                saved[name] = row[0]
+                cursor.execute(f'PRAGMA {name} = {value}')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for name, value in saved.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def scan(queryset, fields, chunk):
+    """Строки queryset словарями по возрастанию pk.
+
+    Каждый запрос берёт chunk строк после последнего pk: в памяти не
+    больше одной пачки при любом размере таблицы, а проход по
+    первичному ключу не замедляется к концу, как OFFSET.
+    """
+    columns = list(fields.values())
+    last = None
+    while True:
+        page = queryset.order_by('pk')
+        if last is not None:
+            page = page.filter(pk__gt=last)
+        rows = list(page.values_list(*columns)[:chunk])
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(fields, row))
+        last = rows[-1][0]
+
+
+def records(kind, chunk, using, since=None, after_id=None):
+    """Записи выгрузки kind из всех её таблиц по очереди.
+
+    since — только строки с CHANGED позже этого момента, after_id —
+    только строки с id больше.
+    """
+    sources = SOURCES[kind]
+    for model in sources:
+        queryset = model.objects.using(using)
+        if since is not None and kind in CHANGED:
+            queryset = queryset.filter(**{f'{CHANGED[kind]}__gt': since})
+        if after_id is not None:
+            queryset = queryset.filter(pk__gt=after_id)
+        for record in scan(queryset, FIELDS[kind], chunk):
+            if len(sources) > 1:
+                record['archived'] = model is not sources[0]
+            yield record
+
+
+def deletions(kind, chunk, using, since):
+    """Отметки {'id', 'deleted'} строк kind, удалённых после since."""
+    queryset = Tombstone.objects.using(using).filter(
+        kind=kind, deleted__gt=since)
+    for record in scan(queryset, TOMBSTONE_FIELDS, chunk):
+        del record['tombstone']
+        yield record
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
+
+
+def write(path, rows):
+    """Пишет записи в path как JSONL в gzip, возвращает их число и
+    наибольший id.
+
+    Файл появляется под своим именем только целиком.
+    """
+    count, last_id = 0, None
+    with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as target:
+        for record in rows:
+            target.write(json.dumps(record, ensure_ascii=False,
+                                    default=_default))
+            target.write('\n')
+            count += 1
+            last_id = max(record['id'], last_id or 0)
+    os.replace(f'{path}.tmp', path)
+    return count, last_id
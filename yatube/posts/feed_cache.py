@@ -0,0 +1,292 @@
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from django.views.decorators.http import condition
+
+from . import thumbnails
+
+GENERATION_KEY = 'feed:gen:{}'
+FRAGMENT_KEY = 'feed:page:{}'
+CARD_KEY = 'feed:card:{}:{}:{}'
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+LOCK_KEY = 'feed:lock:{}'
+STATS_KEY = 'feed:stats:{}'
+STATS_OUTCOMES = ('hits', 'misses', 'stale')
+CURSOR_PARAMS = ('after', 'before', 'page')
+
+# Пересчёт фрагмента дольше LOCK_TIMEOUT секунд считается упавшим
+LOCK_TIMEOUT = 10
+# Сколько ждать чужого пересчёта, если отдать нечего
+LOCK_WAIT = 2
+LOCK_POLL = 0.05
+# Множитель вероятностного раннего обновления (XFetch)
+EARLY_BETA = 1.0
+
+FeedKey = namedtuple('FeedKey', ('key', 'version', 'stale'))
+
+# Счётчики исходов, ещё не перенесённые в кэш, и время последнего переноса
+_pending = Counter()
+_flushed_at = time.monotonic()
+_pending_lock = threading.Lock()
+
+
+def post_scopes(post):
+    scopes = ['global', f'post:{post.pk}', f'author:{post.author_id}']
+    if post.group_id:
+        scopes.append(f'group:{post.group_id}')
+    return scopes
+
+
+def comment_scopes(post):
+    """Области, где виден счётчик комментариев поста."""
+    return [f'post:{post.pk}',
+            *(f'comments:{scope}' for scope in post_scopes(post)
+              if not scope.startswith('post:'))]
+
+
+def page_scopes(posts):
+    """Области постов страницы: пост, его автор и группа."""
+    scopes = set()
+    for post in posts:
+        scopes.update(post_scopes(post))
+    scopes.discard('global')
+    return scopes
+
+
+_last_generation = 0
+
+
+def _fresh_generation():
+    # Поколение — время изменения области в микросекундах: после
+    # вытеснения ключа оно не совпадёт со старым и годится как
+    # Last-Modified. В процессе значения строго растут даже при
+    # грубых часах
+    global _last_generation
+    _last_generation = max(int(time.time() * 1000000), _last_generation + 1)
+    return _last_generation
+
+
+def generations(scopes):
+    keys = {GENERATION_KEY.format(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    missing = {key: _fresh_generation() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return {keys[key]: value for key, value in found.items()}
+
+
+def bump(*scopes):
+    """Делает все закэшированные страницы областей устаревшими.
+
+    Все области пишутся одним set_many, даже при рассылке по тысячам
+    лент подписчиков.
+    """
+    if scopes:
+        generation = _fresh_generation()
+        cache.set_many({GENERATION_KEY.format(scope): generation
+                        for scope in scopes}, None)
+
+
+def page_key(request, scopes):
+    """Ключ фрагмента ленты для get_or_render.
+
+    Место в кэше задают главная область scopes[0] и курсор страницы,
+    версию — поколения всех областей. Сохранение поста меняет версию,
+    и старый фрагмент становится устаревшей копией на время пересчёта.
+    stale — окно stale-while-revalidate главной области в секундах
+    из FEED_CACHE_STALE.
+    """
+    current = generations(scopes)
+    version = hashlib.md5('&'.join(
+        f'{scope}={current[scope]}' for scope in sorted(current)
+    ).encode()).hexdigest()
+    parts = [scopes[0]] + [f'{name}={request.GET.get(name, "")}'
+                           for name in CURSOR_PARAMS]
+    digest = hashlib.md5('&'.join(parts).encode()).hexdigest()
+    stale = settings.FEED_CACHE_STALE.get(scopes[0].split(':')[0], 0)
+    return FeedKey(FRAGMENT_KEY.format(digest), version, stale)
+
+
+def validators(request, current):
+    """ETag и Last-Modified страницы по поколениям её областей.
+
+    current — generations() областей, прочитанные до выборки постов и
+    отрисовки. ETag учитывает курсор и пользователя — шапка и кнопки
+    у каждого свои.
+    """
+    parts = [f'{scope}={current[scope]}' for scope in sorted(current)]
+    parts += [f'{name}={request.GET.get(name, "")}'
+              for name in CURSOR_PARAMS]
+    parts.append(f'user={request.user.pk}')
+    etag = hashlib.md5('&'.join(parts).encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(
+        max(current.values()) / 1000000, timezone.utc)
+    return etag, last_modified
+
+
+def conditional(scopes_for):
+    """condition() для view: 304 по валидаторам областей из scopes_for.
+
+    scopes_for(request, *args, **kwargs) возвращает области страницы
+    или None, если её нет (тогда view сам ответит 404). Поколения,
+    прочитанные до отрисовки, остаются в request.scope_generations:
+    с ними страницу сохраняет кэш page_cache.
+    """
+    def cached_validators(request, *args, **kwargs):
+        if not hasattr(request, 'validators'):
+            scopes = scopes_for(request, *args, **kwargs)
+            request.validators = (None, None)
+            if scopes:
+                request.scope_generations = generations(scopes)
+                request.validators = validators(
+                    request, request.scope_generations)
+        return request.validators
+
+    return condition(
+        etag_func=lambda *args, **kwargs: cached_validators(
+            *args, **kwargs)[0],
+        last_modified_func=lambda *args, **kwargs: cached_validators(
+            *args, **kwargs)[1],
+    )
+
+
+def _count(outcome):
+    """Считает исход в памяти процесса.
+
+    В общий кэш счётчики уходят не чаще раза в FEED_CACHE_STATS_FLUSH
+    секунд: иначе каждое попадание в кэш стоило бы записи в SQLite.
+    Несброшенные счётчики упавшего процесса теряются.
+    """
+    with _pending_lock:
+        _pending[outcome] += 1
+        due = (time.monotonic() - _flushed_at
+               >= settings.FEED_CACHE_STATS_FLUSH)
+    if due:
+        flush_stats()
+
+
+def flush_stats():
+    """Переносит счётчики процесса в общий кэш."""
+    global _flushed_at
+    with _pending_lock:
+        counts = dict(_pending)
+        _pending.clear()
+        _flushed_at = time.monotonic()
+    for outcome, count in counts.items():
+        key = STATS_KEY.format(outcome)
+        if not cache.add(key, count, None):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, None)
+
+
+def _refresh_early(entry, now):
+    # XFetch: чем ближе срок и дольше отрисовка, тем вероятнее, что
+    # один из запросов обновит фрагмент заранее, а не все сразу
+    return (now - entry['delta'] * EARLY_BETA
+            * math.log(1 - random.random()) >= entry['expires'])
+
+
+def _rebuild(feed_key, render, timeout):
+    started = time.time()
+    html, complete = thumbnails.render_complete(render)
+    now = time.time()
+    if not complete:
+        # Миниатюры ещё создаются — не закрепляем исходные картинки
+        return html
+    cache.set(feed_key.key, {
+        'html': html,
+        'version': feed_key.version,
+        'expires': now + timeout,
+        'delta': now - started,
+    }, timeout + feed_key.stale)
+    _count('misses')
+    return html
+
+
+def get_or_render(feed_key, render, timeout=None):
+    """Фрагмент из кэша с защитой от одновременного пересчёта.
+
+    Устаревший фрагмент пересчитывает один запрос, взявший короткую
+    блокировку в кэше; остальные в окне feed_key.stale отдают старую
+    копию, а без неё ждут до LOCK_WAIT секунд.
+    """
+    if timeout is None:
+        timeout = settings.FEED_CACHE_TIMEOUT
+    entry = cache.get(feed_key.key)
+    now = time.time()
+    fresh = (entry is not None
+             and entry['version'] == feed_key.version
+             and now < entry['expires'])
+    if fresh and not _refresh_early(entry, now):
+        _count('hits')
+        return entry['html']
+    lock = LOCK_KEY.format(feed_key.key)
+    if cache.add(lock, 1, LOCK_TIMEOUT):
+        try:
+            return _rebuild(feed_key, render, timeout)
+        finally:
+            cache.delete(lock)
+    if fresh:
+        _count('hits')
+        return entry['html']
+    if entry is not None and feed_key.stale:
+        _count('stale')
+        return entry['html']
+    deadline = now + LOCK_WAIT
+    while time.time() < deadline and cache.get(lock) is not None:
+        time.sleep(LOCK_POLL)
+    entry = cache.get(feed_key.key)
+    if entry is not None and entry['version'] == feed_key.version:
+        _count('hits')
+        return entry['html']
+    return _rebuild(feed_key, render, timeout)
+
+
+def card_key(post):
+    """Ключ карточки: id поста, время его правки и число комментариев."""
+    return CARD_KEY.format(
+        post.pk, post.updated.timestamp(), post.comment_count)
+
+
+def render_cards(posts):
+    """HTML карточек постов страницы: один get_many и отрисовка промахов.
+
+    Миниатюры для отрисовываемых карточек ищутся разом (resolve).
+    Правка поста или новый комментарий меняют ключ только его карточки.
+    """
+    keys = {card_key(post): post for post in posts}
+    found = cache.get_many(list(keys))
+    thumbnails.resolve(
+        [post for key, post in keys.items() if key not in found])
+    missing = {}
+    for key, post in keys.items():
+        if key not in found:
+            found[key], complete = thumbnails.render_complete(
+                lambda: render_to_string(CARD_TEMPLATE, {'post': post}))
+            if complete:
+                missing[key] = found[key]
+    if missing:
+        cache.set_many(missing, settings.FEED_CACHE_TIMEOUT)
+    return [mark_safe(found[key]) for key in keys]
+
+
+def stats():
+    """Счётчики попаданий и промахов кэша лент."""
+    flush_stats()
+    found = cache.get_many([STATS_KEY.format(outcome)
+                            for outcome in STATS_OUTCOMES])
+    return {outcome: found.get(STATS_KEY.format(outcome), 0)
+            for outcome in STATS_OUTCOMES}
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm, Textarea
+from .ingest import ingest
 from .models import Post, Comment
 
 
@@ -18,6 +20,13 @@ class PostForm(forms.ModelForm):
             'image': ('Выберите изображение')
         }
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # Новая загрузка, а не уже сохранённый файл поста
+        if isinstance(image, UploadedFile):
+            return ingest(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
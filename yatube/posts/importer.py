@@ -0,0 +1,262 @@
+import csv
+import gzip
+import json
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import feed_cache
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow, Group,
+                     Post, User)
+
+# Порядок загрузки: записи ссылаются на уже загруженные
+MODELS = {
+    'users': User,
+    'groups': Group,
+    'posts': Post,
+    'comments': Comment,
+    'follows': Follow,
+}
+
+# Поля, без которых запись пропускается, а не роняет загрузку
+REQUIRED = {
+    'users': ('username',),
+    'groups': ('slug', 'title'),
+    'posts': ('author', 'text'),
+    'comments': ('post', 'author', 'text'),
+    'follows': ('user', 'author'),
+}
+
+
+def read_records(path, fmt=None):
+    """Записи файла JSONL или CSV по одной, как словари.
+
+    Файл читается потоком; .gz распаковывается на лету. Формат без
+    fmt определяется по расширению. Битая строка JSONL — ValueError
+    с её номером.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    fmt = fmt or ('csv' if name.endswith('.csv') else 'jsonl')
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as source:
+        if fmt == 'csv':
+            yield from csv.DictReader(source)
+            return
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                raise ValueError(f'{path}, строка {number}: {error}')
+
+
+@contextmanager
+def original_dates(*models):
+    """Отключает auto_now и auto_now_add: bulk_create сохранит даты
+    из выгрузки, а не время импорта."""
+    fields = [field for model in models for field in model._meta.fields
+              if getattr(field, 'auto_now', False)
+              or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def drop_indexes(model):
+    """Удаляет неуникальные индексы таблицы, возвращает их CREATE INDEX.
+
+    Уникальные остаются: на них держится ignore_conflicts при
+    повторной загрузке пачки.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = %s AND sql IS NOT NULL "
+            "AND sql NOT LIKE 'CREATE UNIQUE%%'",
+            [model._meta.db_table])
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def restore_indexes(statements):
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql.replace('CREATE INDEX',
+                                       'CREATE INDEX IF NOT EXISTS', 1))
+
+
+def _date(value):
+    moment = parse_datetime(value) if value else None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.utc)
+    return moment
+
+
+def _id(value):
+    return int(value) if value not in (None, '') else None
+
+
+class Importer:
+    """Превращает записи выгрузки в объекты моделей и пишет их пачками.
+
+    Имена пользователей и slug групп разрешаются через словари в
+    памяти, загруженные один раз. Пропущенные записи считаются в
+    skipped по причинам.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.model = MODELS[kind]
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+        self.skipped = Counter()
+
+    def _skip(self, reason):
+        self.skipped[reason] += 1
+
+    def _user(self, record, field):
+        user_id = self.users.get(record.get(field))
+        if user_id is None:
+            self._skip(f'нет пользователя ({field})')
+        return user_id
+
+    def build(self, record):
+        """Объект модели для bulk_create или None, если запись пропущена."""
+        for field in REQUIRED[self.kind]:
+            if record.get(field) in (None, ''):
+                self._skip(f'нет поля {field}')
+                return None
+        try:
+            return getattr(self, f'build_{self.kind}')(record)
+        except ValueError:
+            # Не число в id или post, несуществующая дата
+            self._skip('неверное значение')
+            return None
+
+    def build_users(self, record):
+        return User(
+            username=record['username'],
+            password=make_password(None),
+            first_name=record.get('first_name') or '',
+            last_name=record.get('last_name') or '',
+            email=record.get('email') or '',
+            date_joined=_date(record.get('date_joined')) or timezone.now())
+
+    def build_groups(self, record):
+        return Group(slug=record['slug'], title=record['title'],
+                     description=record.get('description') or '')
+
+    def build_posts(self, record):
+        author_id = self._user(record, 'author')
+        if author_id is None:
+            return None
+        group_id = None
+        if record.get('group'):
+            group_id = self.groups.get(record['group'])
+            if group_id is None:
+                self._skip('нет группы')
+                return None
+        pub_date = _date(record.get('pub_date'))
+        if pub_date is None:
+            self._skip('нет pub_date')
+            return None
+        return Post(id=_id(record.get('id')), text=record['text'],
+                    pub_date=pub_date,
+                    updated=_date(record.get('updated')) or pub_date,
+                    author_id=author_id, group_id=group_id,
+                    image=record.get('image') or '')
+
+    def build_comments(self, record):
+        author_id = self._user(record, 'author')
+        if author_id is None:
+            return None
+        return Comment(id=_id(record.get('id')), post_id=_id(record['post']),
+                       author_id=author_id, text=record['text'],
+                       created=_date(record.get('created'))
+                       or timezone.now())
+
+    def build_follows(self, record):
+        user_id = self._user(record, 'user')
+        author_id = self._user(record, 'author')
+        if user_id is None or author_id is None:
+            return None
+        if user_id == author_id:
+            self._skip('подписка на себя')
+            return None
+        return Follow(user_id=user_id, author_id=author_id)
+
+    def _split_comments(self, comments, scopes):
+        """Комментарии к горячим постам; комментарии к архивным
+        записываются сразу в архив.
+
+        В архиве нет автоинкремента: комментарий к архивному посту
+        загружается только со своим id.
+        """
+        post_ids = {comment.post_id for comment in comments}
+        fields = ('pk', 'author_id', 'group_id')
+        posts = Post.objects.only(*fields).in_bulk(post_ids)
+        archived = ArchivedPost.objects.only(*fields).in_bulk(
+            post_ids - set(posts))
+        hot, cold = [], []
+        for comment in comments:
+            if comment.post_id in posts:
+                hot.append(comment)
+            elif comment.post_id not in archived:
+                self._skip('нет поста')
+            elif comment.id is None:
+                self._skip('нет id у комментария к архивному посту')
+            else:
+                cold.append(ArchivedComment(
+                    id=comment.id, post_id=comment.post_id,
+                    author_id=comment.author_id, text=comment.text,
+                    created=comment.created))
+        ArchivedComment.objects.bulk_create(cold, ignore_conflicts=True)
+        for post in [*posts.values(), *archived.values()]:
+            scopes.update(feed_cache.comment_scopes(post))
+        return hot
+
+    def save(self, objects):
+        """Пишет пачку одним bulk_create, возвращает области кэша лент.
+
+        ignore_conflicts делает повторную загрузку пачки после сбоя
+        безопасной: уже записанные строки пропускаются.
+        """
+        scopes = set()
+        if self.kind == 'comments':
+            objects = self._split_comments(objects, scopes)
+        with original_dates(self.model):
+            self.model.objects.bulk_create(objects, ignore_conflicts=True)
+        if self.kind == 'users':
+            self.users.update(User.objects.filter(
+                username__in=[user.username for user in objects])
+                .values_list('username', 'pk'))
+        elif self.kind == 'groups':
+            self.groups.update(Group.objects.filter(
+                slug__in=[group.slug for group in objects])
+                .values_list('slug', 'pk'))
+        elif self.kind == 'posts':
+            # Страниц самих новых постов в кэше ещё нет: только ленты
+            scopes.add('global')
+            for post in objects:
+                scopes.update((f'author:{post.author_id}',
+                               f'profile:{post.author_id}'))
+                if post.group_id:
+                    scopes.add(f'group:{post.group_id}')
+        elif self.kind == 'follows':
+            for follow in objects:
+                scopes.update((f'follow:{follow.user_id}',
+                               f'profile:{follow.user_id}',
+                               f'profile:{follow.author_id}'))
+        return scopes
@@ -0,0 +1,104 @@
+import os
+import warnings
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from PIL import Image, ImageOps
+
+# Байт на пиксель после декодирования по режимам Pillow
+BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'RGB': 3, 'YCbCr': 3,
+                   'LA': 2, 'RGBA': 4, 'CMYK': 4, 'I': 4, 'F': 4}
+# Поворот по EXIF и уменьшение держат в памяти вторую копию кадра
+COPIES = 2
+JPEG_QUALITY = 90
+# Формат для картинок, которые Pillow читает, но записать не умеет
+# (XPM, PSD, CUR, …), и режимы кадра, которые он принимает
+FALLBACK_FORMAT = 'PNG'
+FALLBACK_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I')
+
+
+def invalid_image():
+    return ValidationError(
+        'Не удалось обработать картинку: файл повреждён или формат '
+        'не поддерживается.', code='invalid_image')
+
+
+def decoded_bytes(image):
+    """Сколько памяти займёт кадр image после декодирования."""
+    width, height = image.size
+    return COPIES * width * height * BYTES_PER_PIXEL.get(image.mode, 4)
+
+
+def open_header(upload):
+    """Открывает картинку без декодирования; None — бомба распаковки."""
+    upload.seek(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', Image.DecompressionBombWarning)
+        try:
+            return Image.open(upload)
+        except (Image.DecompressionBombWarning,
+                Image.DecompressionBombError):
+            return None
+        except (OSError, ValueError):
+            raise invalid_image()
+
+
+def write(upload, result, image_format):
+    """Записывает кадр result на место файла загрузки."""
+    Image.init()
+    if image_format not in Image.SAVE:
+        image_format = FALLBACK_FORMAT
+        upload.name = os.path.splitext(upload.name)[0] + '.png'
+        if result.mode not in FALLBACK_MODES:
+            result = result.convert('RGBA' if 'A' in result.mode else 'RGB')
+    options = {'quality': JPEG_QUALITY} if image_format == 'JPEG' else {}
+    upload.seek(0)
+    upload.truncate()
+    try:
+        result.save(upload, image_format, **options)
+    except (OSError, ValueError, KeyError):
+        raise invalid_image()
+    upload.size = upload.tell()
+    upload.seek(0)
+
+
+def ingest(upload):
+    """Проверяет и пережимает загруженную картинку поста.
+
+    Загрузка уже лежит на диске (TemporaryFileUploadHandler), размеры
+    читаются из заголовка до декодирования. Слишком большие картинки
+    отклоняются, JPEG декодируется сразу уменьшенным (draft), лишнее
+    обрезается до IMAGE_MAX_SIDE, EXIF отбрасывается. Пиковая память
+    на загрузку не больше IMAGE_DECODE_MEMORY. Результат записывается
+    в тот же файл загрузки; формат, который Pillow не умеет записывать,
+    пережимается в PNG.
+    """
+    if upload.size > settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise ValidationError(
+            'Файл больше %(limit)d МБ.', code='file_too_large',
+            params={'limit': settings.IMAGE_UPLOAD_MAX_BYTES >> 20})
+    image = open_header(upload)
+    width, height = image.size if image else (0, 0)
+    if image is None or width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка больше %(limit)d мегапикселей.', code='too_many_pixels',
+            params={'limit': settings.IMAGE_MAX_PIXELS // 10 ** 6})
+    with image:
+        image_format = image.format
+        side = settings.IMAGE_MAX_SIDE
+        image.draft('RGB', (side, side))
+        if decoded_bytes(image) > settings.IMAGE_DECODE_MEMORY:
+            raise ValidationError(
+                'Картинку %(width)d×%(height)d не получится обработать, '
+                'уменьшите её.', code='too_large_to_decode',
+                params={'width': width, 'height': height})
+        try:
+            result = ImageOps.exif_transpose(image)
+            result.thumbnail((side, side))
+        except (OSError, ValueError):
+            raise invalid_image()
+        # PNG пишет EXIF из info, JPEG — только из параметров save
+        result.info.pop('exif', None)
+    # Кадр уже декодирован в result, файл загрузки можно переписать
+    write(upload, result, image_format)
+    return upload
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from posts import archive
+from posts.models import ArchivedPost, Post
+
+
+class Command(BaseCommand):
+    help = ('Переносит посты старше ARCHIVE_AFTER_DAYS дней вместе с '
+            'комментариями в архивные таблицы и показывает размер '
+            'горячей таблицы постов и её долю в кэше')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Возраст поста для переноса, дней')
+        parser.add_argument('--batch', type=int,
+                            default=settings.ARCHIVE_BATCH,
+                            help='Постов в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать и показать отчёт')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Архив и отчёт только для SQLite')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        if options['dry_run']:
+            self.stdout.write(
+                f'К переносу: {archive.candidates(cutoff).count()}')
+        else:
+            moved = 0
+            while True:
+                ids = archive.move_batch(cutoff, options['batch'])
+                if not ids:
+                    break
+                moved += len(ids)
+                self.stdout.write(f'Перенесено: {moved}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Перенесено в архив: {moved}'))
+        self.report()
+
+    def report(self):
+        try:
+            rows = archive.table_report(Post)
+        except DatabaseError as error:
+            raise CommandError(f'Нет dbstat в этой сборке SQLite: {error}')
+        self.stdout.write(
+            f'Постов в горячей таблице: {Post.objects.count()}, '
+            f'в архиве: {ArchivedPost.objects.count()}')
+        total = 0
+        for name, pages, size, resident in rows:
+            total += size
+            cached = ('нет данных' if resident is None
+                      else f'{resident / pages:.0%}')
+            self.stdout.write(f'  {name}: {pages} стр., '
+                              f'{size / 1024:,.0f} КиБ, в кэше ОС {cached}')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            cache_size = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            page_size = cursor.fetchone()[0]
+        # Отрицательный cache_size — размер в КиБ, положительный — в страницах
+        cache_bytes = (-cache_size * 1024 if cache_size < 0
+                       else cache_size * page_size)
+        self.stdout.write(
+            f'Таблица с индексами: {total / 1024:,.0f} КиБ, '
+            f'кэш страниц SQLite: {cache_bytes / 1024:,.0f} КиБ')
@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import Post
+
+User = get_user_model()
+
+USERNAME = 'db-benchmark'
+
+# (название, PRAGMA, CONN_MAX_AGE): умолчания SQLite и Django против
+# профиля из settings.SQLITE_PRAGMAS с постоянными соединениями
+PROFILES = (
+    ('default', {'journal_mode': 'DELETE', 'synchronous': 'FULL'}, 0),
+    ('production', settings.SQLITE_PRAGMAS,
+     settings.DATABASES['default'].get('CONN_MAX_AGE', 0)),
+)
+
+
+def reader(client, post_id):
+    client.get(reverse('posts:index'))
+    client.get(reverse('posts:profile', kwargs={'username': USERNAME}))
+
+
+def writer(client, post_id):
+    client.post(reverse('posts:post_create'), {'text': 'Замер записи'})
+    client.post(reverse('posts:add_comment', kwargs={'post_id': post_id}),
+                {'text': 'Замер комментария'})
+
+
+def run_worker(role, seconds, post_id, results):
+    """Один процесс: гоняет свою пару запросов seconds секунд."""
+    client = Client()
+    client.force_login(User.objects.get(username=USERNAME))
+    action = {'reader': reader, 'writer': writer}[role]
+    done = errors = 0
+    latencies = []
+    stop = time.monotonic() + seconds
+    while time.monotonic() < stop:
+        started = time.perf_counter()
+        try:
+            action(client, post_id)
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        done += 1
+    connections.close_all()
+    results.put((role, done, errors, latencies))
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность SQLite с умолчаниями и с '
+            'профилем SQLITE_PRAGMAS: читатели index и profile против '
+            'писателей post_create и add_comment на копии базы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+
+    def handle(self, *args, **options):
+        database = connections.databases['default']
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Замер только для SQLite')
+        source = database['NAME']
+        if not os.path.isfile(source):
+            raise CommandError(f'Нет базы {source}: сначала migrate')
+        context = multiprocessing.get_context('fork')
+        with tempfile.TemporaryDirectory() as directory:
+            for name, pragmas, max_age in PROFILES:
+                copy = os.path.join(directory, f'{name}.sqlite3')
+                with sqlite3.connect(source) as original, \
+                        sqlite3.connect(copy) as target:
+                    original.backup(target)
+                connections.close_all()
+                database.update(NAME=copy, CONN_MAX_AGE=max_age)
+                settings.SQLITE_PRAGMAS = pragmas
+                post_id = self.prepare()
+                connections.close_all()
+                results = context.Queue()
+                roles = (['reader'] * options['readers']
+                         + ['writer'] * options['writers'])
+                workers = [context.Process(target=run_worker, args=(
+                    role, options['seconds'], post_id, results))
+                    for role in roles]
+                for worker in workers:
+                    worker.start()
+                outcomes = [results.get() for _ in workers]
+                for worker in workers:
+                    worker.join()
+                self.report(name, outcomes, options['seconds'])
+        database.update(NAME=source)
+
+    @staticmethod
+    def prepare():
+        author, _ = User.objects.get_or_create(username=USERNAME)
+        post = Post.objects.filter(author=author).first()
+        if post is None:
+            post = Post.objects.create(author=author, text='Замер')
+        return post.pk
+
+    def report(self, name, outcomes, seconds):
+        lines = [f'{name}:']
+        for role in ('reader', 'writer'):
+            done = sum(o[1] for o in outcomes if o[0] == role)
+            errors = sum(o[2] for o in outcomes if o[0] == role)
+            latencies = sorted(
+                latency for o in outcomes if o[0] == role for latency in o[3])
+            p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+            lines.append(
+                f'  {role:>6}: {done / seconds:,.1f} итераций/с, '
+                f'p95 {p95 * 1000:.0f} мс, ошибок {errors}')
+        self.stdout.write('\n'.join(lines))
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from posts import feed_cache
+
+KEY = 'feed:page:benchmark'
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пересчёты фрагмента ленты при истечении срока '
+            'без защиты и с single-flight блокировкой')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--seconds', type=float, default=3,
+                            help='Длительность прогона')
+        parser.add_argument('--ttl', type=float, default=1,
+                            help='Срок жизни фрагмента')
+        parser.add_argument('--render-ms', type=float, default=50,
+                            help='Время «запроса к БД и отрисовки»')
+        parser.add_argument('--bucket-ms', type=float, default=100,
+                            help='Шаг гистограммы пересчётов')
+
+    def handle(self, *args, **options):
+        for name, fetch in (('naive', self.naive),
+                            ('protected', self.protected)):
+            cache.delete(KEY)
+            renders = self.run(fetch, options)
+            buckets = Counter(
+                int(moment * 1000 // options['bucket_ms'])
+                for moment in renders)
+            timeline = ' '.join(
+                str(buckets.get(number, 0)) for number in range(
+                    int(options['seconds'] * 1000
+                        // options['bucket_ms'])))
+            self.stdout.write(
+                f'{name:>9}: пересчётов {len(renders)}, '
+                f'пик {max(buckets.values(), default=0)} '
+                f'за {options["bucket_ms"]:.0f} мс\n'
+                f'{"":>11}{timeline}')
+
+    @staticmethod
+    def naive(render, ttl):
+        html = cache.get(KEY)
+        if html is None:
+            html = render()
+            cache.set(KEY, html, ttl)
+        return html
+
+    @staticmethod
+    def protected(render, ttl):
+        key = feed_cache.FeedKey(KEY, 'benchmark', ttl)
+        return feed_cache.get_or_render(key, render, timeout=ttl)
+
+    def run(self, fetch, options):
+        renders = []
+        lock = threading.Lock()
+        started = time.monotonic()
+        stop = started + options['seconds']
+
+        def render():
+            with lock:
+                renders.append(time.monotonic() - started)
+            time.sleep(options['render_ms'] / 1000)
+            return 'html'
+
+        def reader():
+            while time.monotonic() < stop:
+                fetch(render, options['ttl'])
+                time.sleep(0.005)
+
+        threads = [threading.Thread(target=reader)
+                   for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return renders
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts import feed_cache
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания, промахи и устаревшие ответы кэша лент'
+
+    def handle(self, *args, **options):
+        counters = feed_cache.stats()
+        total = sum(counters.values())
+        ratio = (counters['hits'] + counters['stale']) / total if total else 0
+        self.stdout.write(
+            f"hits: {counters['hits']}, misses: {counters['misses']}, "
+            f"stale: {counters['stale']}, hit ratio: {ratio:.1%}")
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+
+from posts import thumbnails
+from posts.models import Post
+from posts.paginator import POSTS_PER_PAGE
+
+
+class Command(BaseCommand):
+    help = ('Считает байты картинок первой страницы ленты: одна обрезка '
+            '960px для всех против варианта из srcset под ширину экрана')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=480,
+                            help='Ширина экрана в CSS-пикселях')
+        parser.add_argument('--dpr', type=float, default=1,
+                            help='Плотность пикселей экрана')
+
+    def handle(self, *args, **options):
+        posts = [post for post in Post.objects.for_feed()[:POSTS_PER_PAGE]
+                 if post.image]
+        thumbnails.resolve(posts)
+        needed = options['width'] * options['dpr']
+        width = next((width for width in thumbnails.WIDTHS
+                      if width >= needed), thumbnails.WIDTHS[-1])
+        variants = {
+            (int(geometry.split('x')[0]), sorl_options['format']): geometry
+            for geometry, sorl_options in thumbnails.GEOMETRIES}
+        largest = variants[thumbnails.WIDTHS[-1], thumbnails.FALLBACK_FORMAT]
+        chosen = variants[width, thumbnails.FORMATS[0]]
+        before = after = skipped = 0
+        for post in posts:
+            if None in post.thumbnails.values():
+                skipped += 1
+                continue
+            before += self.size(post.thumbnails[
+                largest, thumbnails.FALLBACK_FORMAT])
+            after += self.size(post.thumbnails[
+                chosen, thumbnails.FORMATS[0]])
+        self.stdout.write(
+            f'Картинок: {len(posts) - skipped}, без готовых вариантов: '
+            f'{skipped}\n'
+            f'до:    {before} байт (960px {thumbnails.FALLBACK_FORMAT})\n'
+            f'после: {after} байт ({width}px {thumbnails.FORMATS[0]})')
+        if before:
+            self.stdout.write(f'экономия: {100 - after * 100 / before:.0f}%')
+
+    @staticmethod
+    def size(image):
+        return default.storage.size(image.name)
@@ -0,0 +1,92 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core.storage import media_storage
+from posts import media
+from posts.models import MediaFile, Post
+
+ROOT = Post._meta.get_field('image').upload_to
+# Суффикс файла, который убран в сторону перед удалением
+TRASH = '.gc'
+
+
+def walk(directory):
+    """Имена всех файлов media_storage внутри directory."""
+    directories, files = media_storage.listdir(directory)
+    for name in files:
+        yield os.path.join(directory, name)
+    for child in directories:
+        yield from walk(os.path.join(directory, child))
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки постов, на которые больше не ссылается '
+            'ни один пост, вместе с их миниатюрами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=3600,
+                            help='Не трогать файлы моложе стольких секунд: '
+                                 'их пост может ещё сохраняться')
+        parser.add_argument('--recount', action='store_true',
+                            help='Сначала пересчитать ссылки по постам')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            media.recount()
+        cutoff = timezone.now() - timedelta(seconds=options['grace'])
+        garbage = set(MediaFile.objects.filter(
+            refs=0, updated__lt=cutoff).values_list('name', flat=True))
+        known = set(MediaFile.objects.values_list('name', flat=True))
+        if media_storage.exists(ROOT):
+            # Файлы, которые не попали в счётчики: загрузка без поста
+            garbage.update(
+                name for name in walk(ROOT)
+                if name not in known
+                and media_storage.get_modified_time(name) < cutoff)
+        removed = 0
+        for name in sorted(garbage):
+            if options['dry_run']:
+                self.stdout.write(name)
+            elif self.collect(name, name in known, cutoff):
+                removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов без ссылок: {len(garbage)}, удалено: {removed}'))
+
+    @staticmethod
+    @transaction.atomic
+    def collect(name, known, cutoff):
+        """Удаляет файл name, если на него так и не сослались.
+
+        Условный DELETE счётчика берёт блокировку записи SQLite: пост,
+        сославшийся на файл после выборки, либо уже виден проверкам
+        ниже, либо ждёт конца транзакции. Повторная загрузка того же
+        файла обновляет его mtime (core.storage), поэтому файл сначала
+        убирается в сторону и возвращается, если mtime свежий.
+        """
+        deleted = MediaFile.objects.filter(
+            name=name, refs=0, updated__lt=cutoff).delete()[0]
+        if known and not deleted:
+            return False
+        if media.referenced(name):
+            transaction.set_rollback(True)
+            return False
+        path = media_storage.path(name)
+        try:
+            os.replace(path, path + TRASH)
+        except FileNotFoundError:
+            return False
+        if media_storage.get_modified_time(name + TRASH) >= cutoff:
+            os.replace(path + TRASH, path)
+            transaction.set_rollback(True)
+            return False
+        default.kvstore.delete(ImageFile(name, media_storage))
+        os.remove(path + TRASH)
+        return True
@@ -0,0 +1,134 @@
+import json
+import os
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from posts import archive, feed_cache, importer, media
+from posts.models import ImportProgress
+
+
+class Command(BaseCommand):
+    help = ('Быстро загружает пользователей, группы, посты, комментарии '
+            'или подписки из JSONL или CSV (можно .gz) пачками bulk_create')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(importer.MODELS),
+                            help='Что загружать; порядок: '
+                                 + ', '.join(importer.MODELS))
+        parser.add_argument('path', help='Файл .jsonl или .csv, можно .gz')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='Формат, если расширение не подсказывает')
+        parser.add_argument('--batch', type=int, default=5000,
+                            help='Записей в одной транзакции')
+        parser.add_argument('--defer-indexes', action='store_true',
+                            help='Удалить индексы таблицы на время '
+                                 'загрузки и построить заново в конце')
+        parser.add_argument('--resume', action='store_true',
+                            help='Продолжить с места, где загрузка упала')
+        parser.add_argument('--state',
+                            help='Ключ прогресса в таблице ImportProgress, '
+                                 'по умолчанию полный путь PATH')
+
+    def handle(self, *args, **options):
+        kind, path = options['kind'], options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'Нет файла {path}')
+        if connection.vendor != 'sqlite' and options['defer_indexes']:
+            raise CommandError('--defer-indexes только для SQLite')
+        source = options['state'] or os.path.abspath(path)
+        progress = ImportProgress.objects.filter(source=source).first()
+        if progress is not None and options['resume']:
+            if progress.kind != kind:
+                raise CommandError(
+                    f'{source} — прогресс загрузки {progress.kind}')
+            self.stdout.write(f'Продолжаем с записи {progress.done}')
+        else:
+            progress = progress or ImportProgress(source=source)
+            progress.kind, progress.done = kind, 0
+
+        loader = importer.Importer(kind)
+        indexes = json.loads(progress.indexes)
+        if options['defer_indexes'] and not indexes:
+            # DDL в SQLite транзакционна: индексы снимаются вместе
+            # с записью о них
+            with transaction.atomic():
+                indexes = importer.drop_indexes(loader.model)
+                progress.indexes = json.dumps(indexes)
+                progress.save()
+
+        records = islice(importer.read_records(path, options['format']),
+                         progress.done, None)
+        started = time.monotonic()
+        loaded = 0
+        for chunk in self.chunks(records, options['batch'], progress):
+            objects = [obj for obj in map(loader.build, chunk)
+                       if obj is not None]
+            with transaction.atomic():
+                scopes = loader.save(objects)
+                progress.done += len(chunk)
+                progress.save()
+            feed_cache.bump(*scopes)
+            loaded += len(chunk)
+            rate = loaded / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f'{kind}: {progress.done} записей, {rate:,.0f} записей/с')
+
+        if indexes:
+            self.stdout.write('Строим индексы заново')
+            importer.restore_indexes(indexes)
+        self.finish(kind)
+        if progress.pk is not None:
+            progress.delete()
+        elapsed = time.monotonic() - started
+        skipped = ', '.join(f'{reason}: {count}'
+                            for reason, count in loader.skipped.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {kind}: {loaded} записей за {elapsed:.1f} с, '
+            f'{loaded / max(elapsed, 1e-6):,.0f} записей/с'
+            + (f'; пропущено — {skipped}' if skipped else '')))
+
+    @staticmethod
+    def chunks(records, size, progress):
+        """Пачки по size записей; битая строка файла — CommandError."""
+        while True:
+            try:
+                chunk = list(islice(records, size))
+            except ValueError as error:
+                raise CommandError(
+                    f'{error}; загружено записей: {progress.done}')
+            if not chunk:
+                return
+            yield chunk
+
+    def finish(self, kind):
+        """То, что при обычном сохранении делают сигналы posts.signals:
+        bulk_create их не посылает."""
+        options = {'stdout': self.stdout}
+        if kind == 'posts':
+            self.archive_old()
+        call_command('recount_stats', **options)
+        if kind == 'posts':
+            call_command('rebuild_search_index', **options)
+            media.recount()
+        if kind in ('posts', 'follows'):
+            call_command('rebuild_timelines', **options)
+
+    def archive_old(self):
+        """Переносит загруженные посты старше ARCHIVE_AFTER_DAYS в архив:
+        ключи архива должны быть меньше ключей горячей таблицы."""
+        cutoff = timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+        moved = 0
+        while True:
+            ids = archive.move_batch(cutoff, settings.ARCHIVE_BATCH)
+            if not ids:
+                break
+            moved += len(ids)
+        if moved:
+            self.stdout.write(f'Перенесено в архив: {moved}')
@@ -0,0 +1,57 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Follow,
+                          Post, UserStats)
+
+User = get_user_model()
+
+
+def _grouped(*querysets, field):
+    totals = Counter()
+    for queryset in querysets:
+        totals.update(dict(queryset.values_list(field)
+                           .annotate(total=Count('pk')).order_by()))
+    return totals
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики UserStats и чинит расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        actual = {
+            'posts_count': _grouped(Post.objects, ArchivedPost.objects,
+                                    field='author_id'),
+            'followers_count': _grouped(Follow.objects, field='author_id'),
+            'following_count': _grouped(Follow.objects, field='user_id'),
+            'comments_count': _grouped(Comment.objects,
+                                       ArchivedComment.objects,
+                                       field='author_id'),
+        }
+        stored = UserStats.objects.in_bulk()
+        drifted, created = [], []
+        for user_id in User.objects.values_list('pk', flat=True).iterator():
+            values = {field: counts.get(user_id, 0)
+                      for field, counts in actual.items()}
+            stats = stored.get(user_id)
+            if stats is None:
+                created.append(UserStats(user_id=user_id, **values))
+                continue
+            if any(getattr(stats, field) != value
+                   for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(stats, field, value)
+                drifted.append(stats)
+        if not options['dry_run']:
+            UserStats.objects.bulk_create(created, batch_size=500)
+            UserStats.objects.bulk_update(
+                drifted, list(actual), batch_size=500)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {len(created)}, исправлено: {len(drifted)}'))
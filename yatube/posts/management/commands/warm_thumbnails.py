@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from posts import media, thumbnails
+
+
+class Command(BaseCommand):
+    help = ('Создаёт миниатюры всех размеров для картинок постов, '
+            'в том числе архивных')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        names = media.image_names()
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for name, error in zip(names, pool.map(self.warm, names)):
+                if error is None:
+                    done += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово картинок: {done}, с ошибками: {failed}'))
+
+    @staticmethod
+    def warm(name):
+        try:
+            thumbnails.generate_in_thread(name)
+        except Exception as error:
+            return error
+        return None
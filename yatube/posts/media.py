@@ -0,0 +1,61 @@
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import ArchivedPost, MediaFile, Post
+
+# Таблицы, посты которых ссылаются на файлы media_storage
+IMAGE_MODELS = (Post, ArchivedPost)
+
+
+def retain(name):
+    """Ещё один пост ссылается на файл name."""
+    if not name:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {MediaFile._meta.db_table} (name, refs, updated) '
+            f'VALUES (%s, 1, %s) ON CONFLICT (name) DO UPDATE '
+            f'SET refs = refs + 1, updated = excluded.updated',
+            [name, timezone.now()])
+
+
+def release(name):
+    """Пост больше не ссылается на файл name; сам файл удалит gc_media."""
+    if name:
+        # updated отсчитывает срок --grace у gc_media
+        MediaFile.objects.filter(name=name, refs__gte=1).update(
+            refs=F('refs') - 1, updated=timezone.now())
+
+
+def referenced(name):
+    """Ссылается ли на файл name хоть один пост, горячий или архивный."""
+    return any(model.objects.filter(image=name).exists()
+               for model in IMAGE_MODELS)
+
+
+def image_names():
+    """Имена всех картинок горячих и архивных постов без повторов."""
+    names = set()
+    for model in IMAGE_MODELS:
+        names.update(model.objects.exclude(image='').exclude(image=None)
+                     .values_list('image', flat=True).distinct())
+    return sorted(names)
+
+
+def recount():
+    """Честный пересчёт ссылок по горячей и архивной таблицам постов."""
+    counts = Counter()
+    for model in IMAGE_MODELS:
+        counts.update(dict(
+            model.objects.exclude(image='').exclude(image=None).order_by()
+            .values('image').annotate(total=Count('pk'))
+            .values_list('image', 'total')))
+    for media in MediaFile.objects.all():
+        refs = counts.pop(media.name, 0)
+        if media.refs != refs:
+            MediaFile.objects.filter(name=media.name).update(refs=refs)
+    MediaFile.objects.bulk_create(
+        MediaFile(name=name, refs=refs) for name, refs in counts.items())
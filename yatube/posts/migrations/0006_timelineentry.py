@@ -0,0 +1,74 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:54
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    """Раскладывает по лентам посты уже существующих подписок.
+
+    Дальше ленты ведут сигналы; авторов выше TIMELINE_FANOUT_THRESHOLD
+    лента подмешивает при чтении, их посты не раскладываются.
+    """
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    popular = list(
+        Follow.objects.values('author_id')
+        .annotate(followers=Count('id'))
+        .filter(followers__gt=settings.TIMELINE_FANOUT_THRESHOLD)
+        .values_list('author_id', flat=True))
+    reader_ids = (Follow.objects.order_by('user_id')
+                  .values_list('user_id', flat=True).distinct())
+    for user_id in reader_ids.iterator():
+        author_ids = (Follow.objects.filter(user_id=user_id)
+                      .exclude(author_id__in=popular)
+                      .values_list('author_id', flat=True))
+        posts = (Post.objects.filter(author_id__in=author_ids)
+                 .order_by('-pub_date', '-pk')
+                 .values_list('pk', 'author_id', 'pub_date')
+                 [:settings.TIMELINE_MAX_ENTRIES])
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, post_id=post_id,
+                           author_id=author_id, pub_date=pub_date)
+             for post_id, author_id, pub_date in posts],
+            ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0005_auto_20220426_2301'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='posts.Post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-pub_date', '-post'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='uniq_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
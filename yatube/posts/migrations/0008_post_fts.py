@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_userstats'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                'CREATE VIRTUAL TABLE posts_post_fts USING fts5('
+                'text, group_title, '
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+                'INSERT INTO posts_post_fts (rowid, text, group_title) '
+                "SELECT p.id, replace(replace(p.text, 'ё', 'е'), 'Ё', 'Е'), "
+                "replace(replace(coalesce(g.title, ''), 'ё', 'е'), 'Ё', 'Е') "
+                'FROM posts_post p '
+                'LEFT JOIN posts_group g ON g.id = p.group_id',
+            ],
+            reverse_sql='DROP TABLE posts_post_fts',
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:30
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Файл')),
+                ('refs', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Изменён')),
+            ],
+            options={
+                'verbose_name': 'Медиафайл',
+                'verbose_name_plural': 'Медиафайлы',
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Картинка'),
+        ),
+        # Ссылки на уже загруженные файлы
+        migrations.RunSQL(
+            'INSERT INTO posts_mediafile (name, refs, updated) '
+            'SELECT image, count(*), CURRENT_TIMESTAMP FROM posts_post '
+            "WHERE image IS NOT NULL AND image != '' GROUP BY image",
+            migrations.RunSQL.noop,
+        ),
+    ]
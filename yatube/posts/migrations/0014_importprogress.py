@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_userstats_pulled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=500, unique=True, verbose_name='Источник')),
+                ('kind', models.CharField(max_length=20, verbose_name='Что загружается')),
+                ('done', models.PositiveIntegerField(default=0, verbose_name='Загружено записей')),
+                ('indexes', models.TextField(default='[]', verbose_name='Снятые индексы')),
+            ],
+            options={
+                'verbose_name': 'Прогресс загрузки',
+                'verbose_name_plural': 'Прогресс загрузок',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_importprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='Выгрузка')),
+                ('object_id', models.PositiveIntegerField(verbose_name='id строки')),
+                ('deleted', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Удалена')),
+            ],
+            options={
+                'verbose_name': 'Удалённая строка',
+                'verbose_name_plural': 'Удалённые строки',
+            },
+        ),
+    ]
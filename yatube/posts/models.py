@@ -1,9 +1,33 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 
+from core.storage import media_storage
+
 User = get_user_model()
 
 
+def comment_count(post_ref, comments=None):
+    """Подзапрос числа комментариев к посту из внешнего запроса.
+
+    comments — модель комментариев, по умолчанию Comment.
+    """
+    counts = ((comments or Comment).objects.filter(post=OuterRef(post_ref))
+              .order_by().values('post').annotate(total=Count('pk'))
+              .values('total'))
+    return Coalesce(Subquery(counts, output_field=models.IntegerField()), 0)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты для лент: автор, группа и число комментариев одним
+        запросом, без отдельных запросов на каждый пост страницы."""
+        comments = self.model._meta.get_field('comments').related_model
+        return self.select_related('author', 'group').annotate(
+            comment_count=comment_count('pk', comments))
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name='Текст сообщения',
                             help_text=('Обязательное поле,'
@@ -13,9 +37,13 @@ class Post(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    # Версия поста для кэша карточек (feed_cache.render_cards)
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
+    # Одиночные индексы не нужны: их заменяют составные из Meta.indexes
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='posts',
         verbose_name='Автор',
         help_text='Выберите имя автора')
@@ -23,20 +51,34 @@ class Post(models.Model):
         'Group',
         blank=True, null=True,
         on_delete=models.SET_NULL,
+        db_index=False,
         related_name='posts',
         verbose_name='Группа',
         help_text='Выберите название группы')
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=media_storage,
         blank=True,
         null=True
     )
 
+    objects = PostQuerySet.as_manager()
+
+    archived = False
+
     class Meta:
         ordering = ("-pub_date",)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Ленты профиля и группы идут по (pub_date, id) внутри автора
+        # или группы — без сортировки во временном B-дереве
+        indexes = (
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_date_idx'),
+        )
 
     def __str__(self):
         """ выводим текст поста """
@@ -59,6 +101,7 @@ class Group(models.Model):
 class Comment(models.Model):
     """Оставить комментарий"""
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             db_index=False,
                              related_name='comments', verbose_name='Пост',
                              help_text='Под каким постом оставлен комментарий')
     author = models.ForeignKey(User, on_delete=models.CASCADE,
@@ -74,6 +117,79 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = (
+            models.Index(fields=['post', '-created'],
+                         name='comment_post_created_idx'),
+        )
+
+    def __str__(self):
+        return self.text[:15]
+
+
+class ArchivedPost(models.Model):
+    """Холодная копия старого поста, перенесённого manage.py archive_posts.
+
+    id совпадает с id поста в posts_post, поэтому ссылки, курсоры
+    лент и поисковый индекс продолжают работать. Архивный пост
+    только читается: его нельзя править и комментировать.
+    """
+    id = models.IntegerField(primary_key=True)
+    text = models.TextField('Текст сообщения')
+    pub_date = models.DateTimeField('Дата публикации', db_index=True)
+    updated = models.DateTimeField('Дата изменения')
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               db_index=False,
+                               related_name='archived_posts',
+                               verbose_name='Автор')
+    group = models.ForeignKey(Group,
+                              blank=True, null=True,
+                              on_delete=models.SET_NULL,
+                              db_index=False,
+                              related_name='archived_posts',
+                              verbose_name='Группа')
+    image = models.ImageField('Картинка', upload_to='posts/',
+                              storage=media_storage, blank=True, null=True)
+
+    objects = PostQuerySet.as_manager()
+
+    archived = True
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = 'Архивный пост'
+        verbose_name_plural = 'Архивные посты'
+        indexes = (
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='archived_author_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='archived_group_date_idx'),
+        )
+
+    def __str__(self):
+        return self.text[:15]
+
+
+class ArchivedComment(models.Model):
+    """Комментарий архивного поста, переносится вместе с ним."""
+    id = models.IntegerField(primary_key=True)
+    post = models.ForeignKey(ArchivedPost, on_delete=models.CASCADE,
+                             db_index=False, related_name='comments',
+                             verbose_name='Пост')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='archived_comments',
+                               verbose_name='Автор комментария')
+    text = models.TextField('Текст комментария')
+    created = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name = 'Архивный комментарий'
+        verbose_name_plural = 'Архивные комментарии'
+        indexes = (
+            models.Index(fields=['post', '-created'],
+                         name='archived_comment_post_idx'),
+        )
 
     def __str__(self):
         return self.text[:15]
@@ -97,3 +213,122 @@ class Follow(models.Model):
 
     def __str__(self):
         return f'{self.user}'
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента «Избранные авторы».
+
+    Строка на пару (читатель, пост) заполняется при публикации поста,
+    поэтому лента подписок читается одним проходом по индексу
+    (user, pub_date, post) без соединения с Follow.
+    """
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='timeline')
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name='timeline_entries')
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name='+')
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        constraints = (
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='uniq_timeline_entry'),
+        )
+        indexes = (
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_date_idx'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.user} <- {self.post_id}'
+
+
+class UserStats(models.Model):
+    """Денормализованные счётчики пользователя для профиля и поста.
+
+    Меняются атомарными F()-обновлениями в posts.signals,
+    расхождения чинит manage.py recount_stats.
+    """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='stats')
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+    comments_count = models.PositiveIntegerField('Комментариев', default=0)
+    # Посты автора не раскладывались по лентам, пока подписчиков было
+    # больше порога: их подмешивают при чтении до rebuild_timelines
+    pulled = models.BooleanField('Читается из постов', default=False)
+
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+    def __str__(self):
+        return f'{self.user}'
+
+
+class MediaFile(models.Model):
+    """Сколько постов ссылается на файл из media_storage.
+
+    Одинаковые картинки хранятся одним файлом, поэтому удалить файл
+    можно, только когда ссылок не осталось. Счётчик меняют сигналы
+    posts.signals, файлы без ссылок удаляет manage.py gc_media.
+    """
+    name = models.CharField('Файл', max_length=100, primary_key=True)
+    refs = models.PositiveIntegerField('Ссылок', default=0)
+    updated = models.DateTimeField('Изменён', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Медиафайл'
+        verbose_name_plural = 'Медиафайлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.refs})'
+
+
+class ImportProgress(models.Model):
+    """Сколько записей файла загрузил manage.py import_yatube.
+
+    Строка обновляется в той же транзакции, что и пачка записей:
+    после сбоя --resume продолжает ровно с первой незаписанной.
+    """
+    source = models.CharField('Источник', max_length=500, unique=True)
+    kind = models.CharField('Что загружается', max_length=20)
+    done = models.PositiveIntegerField('Загружено записей', default=0)
+    # JSON-список CREATE INDEX снятых на время загрузки индексов
+    indexes = models.TextField('Снятые индексы', default='[]')
+
+    class Meta:
+        verbose_name = 'Прогресс загрузки'
+        verbose_name_plural = 'Прогресс загрузок'
+
+    def __str__(self):
+        return f'{self.source}: {self.kind}, {self.done}'
+
+
+class Tombstone(models.Model):
+    """Отметка об удалённой строке для export_yatube --incremental.
+
+    Удалённой строки уже нет в таблице, и выгрузка изменений узнаёт
+    о ней только отсюда. Отметки пишут сигналы posts.signals.
+    """
+    kind = models.CharField('Выгрузка', max_length=20)
+    object_id = models.PositiveIntegerField('id строки')
+    deleted = models.DateTimeField('Удалена', auto_now_add=True,
+                                   db_index=True)
+
+    class Meta:
+        verbose_name = 'Удалённая строка'
+        verbose_name_plural = 'Удалённые строки'
+
+    def __str__(self):
+        return f'{self.kind}: {self.object_id}'
@@ -0,0 +1,112 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from . import thumbnails
+from .feed_cache import generations
+
+PAGE_KEY = 'page:{}'
+HEADER = 'X-Page-Cache'
+VALIDATORS = ('ETag', 'Last-Modified')
+
+
+def cache_anonymous(view_func):
+    """Декоратор view: анонимам GET-ответ отдаётся из кэша целиком."""
+    view_func.cache_anonymous = True
+    return view_func
+
+
+def tag(request, *scopes):
+    """Области feed_cache страницы: их bump вычищает её из кэша."""
+    if hasattr(request, 'page_scopes'):
+        request.page_scopes.update(scopes)
+
+
+def _key(request):
+    path = request.get_full_path().encode()
+    return PAGE_KEY.format(hashlib.md5(path).hexdigest())
+
+
+class AnonymousPageCacheMiddleware:
+    """Кэш готовых страниц для анонимных читателей.
+
+    Каждая страница хранится вместе с поколениями областей, которыми
+    её пометил view (посты, авторы, группы). При чтении поколения
+    сверяются с текущими: сигнал, сделавший bump области, вычищает
+    ровно те страницы, где она встречается. Заголовок X-Page-Cache
+    показывает HIT или MISS, Age — возраст отданной копии в секундах.
+    ETag и Last-Modified сохраняются вместе с копией, так что и из
+    кэша клиент может получить 304. Поколения областей view берутся
+    прочитанными до отрисовки (см. _snapshot).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response, complete = thumbnails.render_complete(
+            lambda: self.get_response(request))
+        scopes = getattr(request, 'page_scopes', None)
+        if scopes is not None and response.get(HEADER) is None:
+            response[HEADER] = 'MISS'
+            if complete and self._cacheable(request, response):
+                cache.set(_key(request), {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'validators': {name: response[name]
+                                   for name in VALIDATORS
+                                   if response.has_header(name)},
+                    'scopes': self._snapshot(request, scopes),
+                    'stored': time.time(),
+                }, settings.PAGE_CACHE_TIMEOUT)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (not getattr(view_func, 'cache_anonymous', False)
+                or request.method != 'GET'
+                or request.user.is_authenticated):
+            return None
+        entry = cache.get(_key(request))
+        if (entry is not None
+                and generations(entry['scopes']) == entry['scopes']):
+            response = HttpResponse(entry['content'],
+                                    content_type=entry['content_type'])
+            for name, value in entry['validators'].items():
+                response[name] = value
+            response[HEADER] = 'HIT'
+            response['Age'] = int(time.time() - entry['stored'])
+            return get_conditional_response(
+                request,
+                etag=response.get('ETag'),
+                last_modified=parse_http_date_safe(
+                    response.get('Last-Modified')),
+                response=response)
+        request.page_scopes = set()
+        return None
+
+    @staticmethod
+    def _snapshot(request, scopes):
+        """Поколения, с которыми страница сохраняется.
+
+        Области страницы из conditional() берутся такими, какими они
+        были до отрисовки: если запись сделала им bump, пока страница
+        рисовалась, копия сразу окажется устаревшей, а не проживёт
+        до PAGE_CACHE_TIMEOUT. Любая правка поста или комментария
+        меняет и эти области.
+        """
+        before = getattr(request, 'scope_generations', {})
+        current = generations(set(scopes) | set(before))
+        current.update(before)
+        return current
+
+    @staticmethod
+    def _cacheable(request, response):
+        # Страница с CSRF-токеном или cookie принадлежит одному клиенту
+        return (response.status_code == 200
+                and not response.cookies
+                and not request.META.get('CSRF_COOKIE_USED'))
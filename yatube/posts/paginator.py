@@ -0,0 +1,284 @@
+import base64
+import binascii
+import heapq
+import json
+import logging
+import time
+from collections import namedtuple
+from itertools import islice
+
+from django.core.paginator import Paginator
+from django.http import Http404
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from . import search
+
+POSTS_PER_PAGE = 10
+# Старые ссылки ?page=N читаются OFFSET, а у слияния лент — всем
+# префиксом из каждого потока, поэтому дальше этой страницы они не ведут
+LEGACY_MAX_PAGE = 10
+
+logger = logging.getLogger(__name__)
+
+FeedStream = namedtuple('FeedStream', ('queryset', 'keys', 'to_item'))
+
+
+def encode_cursor(date_value, id_value, number):
+    """Упаковывает позицию в ленте в непрозрачный токен для URL.
+
+    Первый ключ — дата или число (например, ранг поиска).
+    """
+    if hasattr(date_value, 'isoformat'):
+        date_value = date_value.isoformat()
+    raw = json.dumps([date_value, id_value, number])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбирает токен курсора, битый токен считается отсутствующим."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        date_value, id_value, number = json.loads(raw.decode())
+        if isinstance(date_value, str):
+            date_value = parse_datetime(date_value)
+        elif not isinstance(date_value, (int, float)):
+            return None
+        id_value, number = int(id_value), int(number)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        return None
+    if date_value is None or number < 1:
+        return None
+    return date_value, id_value, number
+
+
+def keyset_slice(queryset, keys, cursor, limit, reverse=False):
+    """Одна индексная выборка limit строк строго после курсора."""
+    date_key, id_key = keys
+    if cursor is not None:
+        date_value, id_value = cursor
+        lookup = 'gt' if reverse else 'lt'
+        queryset = queryset.filter(
+            Q(**{f'{date_key}__{lookup}': date_value})
+            | Q(**{date_key: date_value, f'{id_key}__{lookup}': id_value})
+        )
+    prefix = '' if reverse else '-'
+    return list(queryset.order_by(prefix + date_key, prefix + id_key)[:limit])
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация ленты по паре (pub_date, id).
+
+    Страница выбирается условием «строго раньше (или позже) курсора»
+    без COUNT(*) и OFFSET, поэтому её стоимость не зависит ни от
+    глубины страницы, ни от размера таблицы. Номер страницы и
+    количество страниц известны только относительно текущей позиции:
+    paginator.num_pages равен номеру следующей страницы, если она есть.
+
+    archive — такая же выборка из архивной таблицы: лента читает её,
+    только когда горячая таблица кончилась. Все ключи архива меньше
+    ключей горячей таблицы (archive_posts переносит старые посты),
+    поэтому две выборки просто продолжают друг друга.
+    """
+
+    def __init__(self, object_list, per_page=POSTS_PER_PAGE,
+                 keys=('pub_date', 'pk'), archive=None):
+        super().__init__(object_list, per_page)
+        self.date_key, self.id_key = keys
+        self.archive = archive
+        self.count = 0
+        self.num_pages = 1
+
+    def get_page(self, params):
+        after = decode_cursor(params.get('after'))
+        before = decode_cursor(params.get('before'))
+        if after is not None:
+            rows = self._slice(after[:2])
+            return self._build_page(rows, after[2])
+        if before is not None:
+            rows = self._slice(before[:2], reverse=True)
+            if len(rows) > self.per_page:
+                rows = rows[:self.per_page][::-1]
+                return self._build_page(rows, max(before[2], 2),
+                                        has_next=True)
+        number = self._legacy_number(params.get('page'))
+        if number > LEGACY_MAX_PAGE:
+            raise Http404(f'Страница {number}: листайте ленту курсором')
+        if number > 1:
+            rows = self._offset_slice((number - 1) * self.per_page)
+            if not rows:
+                raise Http404(f'Страница {number}: лента короче')
+            return self._build_page(rows, number)
+        return self._build_page(self._slice(None), 1)
+
+    @staticmethod
+    def _legacy_number(value):
+        """Номер из старых ссылок вида ?page=N."""
+        try:
+            return max(int(value), 1)
+        except (TypeError, ValueError):
+            return 1
+
+    def _ordered(self, queryset):
+        return queryset.order_by('-' + self.date_key, '-' + self.id_key)
+
+    def _offset_slice(self, offset):
+        limit = self.per_page + 1
+        rows = list(self._ordered(self.object_list)[offset:offset + limit])
+        if len(rows) < limit and self.archive is not None:
+            # Страница, начавшаяся за горячей таблицей, продолжает архив
+            # со смещения за вычетом горячих строк; offset не больше
+            # LEGACY_MAX_PAGE страниц, так что подсчёт дешёвый
+            start = 0
+            if not rows:
+                start = offset - self.object_list[:offset].count()
+            rows += self._ordered(self.archive)[
+                start:start + limit - len(rows)]
+        return rows
+
+    def _slice(self, cursor, reverse=False):
+        keys = (self.date_key, self.id_key)
+        limit = self.per_page + 1
+        first, rest = self.object_list, self.archive
+        if reverse and rest is not None:
+            # Назад от курсора архив идёт раньше горячей таблицы
+            first, rest = rest, first
+        rows = keyset_slice(first, keys, cursor, limit, reverse)
+        if len(rows) < limit and rest is not None:
+            rows += keyset_slice(rest, keys, cursor, limit - len(rows),
+                                 reverse)
+        return rows
+
+    def _cursor_for(self, row, number):
+        return encode_cursor(getattr(row, self.date_key),
+                             getattr(row, self.id_key), number)
+
+    def _build_page(self, rows, number, has_next=None):
+        if has_next is None:
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+        self.count = (number - 1) * self.per_page + len(rows)
+        self.num_pages = number + 1 if has_next else number
+        page = self._get_page(rows, number, self)
+        page.next_cursor = (
+            self._cursor_for(rows[-1], number + 1) if has_next else None)
+        page.previous_cursor = (
+            self._cursor_for(rows[0], number - 1)
+            if number > 1 and rows else None)
+        return page
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """Курсорная пагинация поверх k-way слияния нескольких лент.
+
+    Каждый FeedStream отсортирован по (pub_date, id) и читается своим
+    keyset-запросом не больше чем на страницу вперёд, а heapq.merge
+    сливает их в одну ленту. Потоки не должны пересекаться по постам.
+    Стоимость слияния пишется в merge_stats и в лог posts.paginator.
+
+    Потоки archive читаются, только когда основные кончились, как
+    archive у CursorPaginator. Их ключи меньше ключей основных потоков,
+    между собой они сливаются так же.
+    """
+
+    def __init__(self, streams, per_page=POSTS_PER_PAGE, archive=()):
+        super().__init__(list(streams), per_page, archive=list(archive))
+        self.merge_stats = {}
+
+    @staticmethod
+    def _read(streams, cursor, limit, reverse):
+        return [
+            [stream.to_item(row) for row in keyset_slice(
+                stream.queryset, stream.keys, cursor, limit, reverse)]
+            for stream in streams
+        ]
+
+    def _merge(self, cursor, limit, reverse=False):
+        started = time.monotonic()
+        groups = [self.object_list, self.archive]
+        if reverse:
+            groups.reverse()
+        rows, chunks = [], {}
+        for streams in groups:
+            if len(rows) >= limit or not streams:
+                continue
+            group_chunks = self._read(streams, cursor, limit - len(rows),
+                                      reverse)
+            merged = heapq.merge(
+                *group_chunks, key=lambda item: (item.pub_date, item.pk),
+                reverse=not reverse)
+            rows += islice(merged, limit - len(rows))
+            chunks[streams is self.archive] = group_chunks
+        read = chunks.get(False, []) + chunks.get(True, [])
+        self.merge_stats = {
+            'streams': len(chunks.get(False, [])),
+            'archive_streams': len(chunks.get(True, [])),
+            'rows_read': sum(len(chunk) for chunk in read),
+            'rows_used': len(rows),
+            'merge_ms': round((time.monotonic() - started) * 1000, 3),
+        }
+        logger.debug('feed merge: %s', self.merge_stats)
+        return rows
+
+    def _offset_slice(self, offset):
+        rows = self._merge(None, offset + self.per_page + 1)
+        return rows[offset:]
+
+    def _slice(self, cursor, reverse=False):
+        return self._merge(cursor, self.per_page + 1, reverse)
+
+
+class SearchPaginator(CursorPaginator):
+    """Курсорная пагинация результатов поиска по паре (ранг BM25, id)."""
+
+    def __init__(self, match, queryset, per_page=POSTS_PER_PAGE,
+                 archive=None):
+        super().__init__(queryset, per_page, keys=('search_rank', 'pk'),
+                         archive=archive)
+        self.match = match
+
+    def _load(self, ranked_rows):
+        posts = self.object_list.in_bulk([pk for pk, _ in ranked_rows])
+        missing = [pk for pk, _ in ranked_rows if pk not in posts]
+        if missing and self.archive is not None:
+            # Индекс общий: id архивных постов не пересекаются с горячими
+            posts.update(self.archive.in_bulk(missing))
+        rows = []
+        for pk, rank in ranked_rows:
+            post = posts.get(pk)
+            if post is not None:
+                post.search_rank = rank
+                rows.append(post)
+        return rows
+
+    def _collect(self, cursor, reverse=False, offset=0):
+        """per_page + 1 постов из выдачи FTS, если они там есть.
+
+        Строки индекса без поста (индекс отстал от удаления) отбрасываются
+        в _load; выдача дочитывается после последней из них, чтобы
+        has_next считался по оставшимся постам.
+        """
+        limit = self.per_page + 1
+        rows = []
+        while True:
+            wanted = limit - len(rows)
+            ranked_rows = search.ranked(self.match, cursor, wanted, reverse,
+                                        offset)
+            rows += self._load(ranked_rows)
+            if len(rows) >= limit or len(ranked_rows) < wanted:
+                return rows
+            pk, rank = ranked_rows[-1]
+            cursor, offset = (rank, pk), 0
+
+    def _offset_slice(self, offset):
+        return self._collect(None, offset=offset)
+
+    def _slice(self, cursor, reverse=False):
+        return self._collect(cursor, reverse)
+
+
+def paginate(request, queryset, **kwargs):
+    """Страница ленты по параметрам запроса ?after=, ?before= и ?page=."""
+    return CursorPaginator(queryset, **kwargs).get_page(request.GET)
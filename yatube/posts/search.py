@@ -0,0 +1,119 @@
+import re
+
+from django.db import connection
+
+FTS_TABLE = 'posts_post_fts'
+
+# Вес столбцов в BM25: совпадение в тексте важнее, чем в названии группы
+RANK = f'bm25({FTS_TABLE}, 1.0, 0.5)'
+
+# Индекс общий для горячей и архивной таблиц постов: id не пересекаются
+POST_TABLES = ('posts_post', 'posts_archivedpost')
+
+# unicode61 не сводит «ё» к «е», поэтому нормализуем сами
+INDEXED_ROWS = ' UNION ALL '.join(
+    "SELECT p.id, replace(replace(p.text, 'ё', 'е'), 'Ё', 'Е'), "
+    "replace(replace(coalesce(g.title, ''), 'ё', 'е'), 'Ё', 'Е') "
+    f'FROM {table} p LEFT JOIN posts_group g ON g.id = p.group_id'
+    for table in POST_TABLES
+)
+
+# Частые окончания, от длинных к коротким: «постами» ищется как «пост*»
+ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ией', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ых',
+    'их', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ов', 'ев', 'ей', 'ы',
+    'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь',
+), key=len, reverse=True)
+MIN_STEM = 3
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def stem(word):
+    """Грубо отрезает окончание, оставляя основу не короче MIN_STEM."""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def build_match(query):
+    """Превращает ввод пользователя в безопасное выражение MATCH.
+
+    Каждое слово ищется по основе как префикс, слова объединяются
+    через AND. Синтаксис FTS5 из ввода не пропускается.
+    """
+    words = re.findall(r'\w+', normalize(query).lower())
+    return ' '.join(f'"{stem(word)}"*' for word in words)
+
+
+def index_post(post):
+    title = post.group.title if post.group_id else ''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {FTS_TABLE} (rowid, text, group_title) '
+            'VALUES (%s, %s, %s)',
+            [post.pk, normalize(post.text), normalize(title)])
+
+
+def unindex_post(post_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [post_id])
+
+
+def reindex_group(group_id, title):
+    """Обновляет название группы у всех её постов, по запросу на таблицу."""
+    with connection.cursor() as cursor:
+        for table in POST_TABLES:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {FTS_TABLE} '
+                '(rowid, text, group_title) '
+                "SELECT id, replace(replace(text, 'ё', 'е'), 'Ё', 'Е'), %s "
+                f'FROM {table} WHERE group_id = %s',
+                [normalize(title), group_id])
+
+
+def rebuild():
+    """Заполняет индекс заново по таблице постов, возвращает число строк."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text, group_title) '
+            + INDEXED_ROWS)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def ranked(match, cursor=None, limit=None, reverse=False, offset=0):
+    """Пары (id поста, ранг BM25), лучшие первыми.
+
+    cursor — (ранг, id) последней показанной строки: выборка идёт
+    строго после неё (или до неё при reverse), как keyset_slice.
+    """
+    sql = (f'SELECT rowid, {RANK} AS score FROM {FTS_TABLE} '
+           f'WHERE {FTS_TABLE} MATCH %s')
+    params = [match]
+    if cursor is not None:
+        op = '<' if reverse else '>'
+        sql += (f' AND ({RANK} {op} %s '
+                f'OR ({RANK} = %s AND rowid {op} %s))')
+        params += [cursor[0], cursor[0], cursor[1]]
+    direction = 'DESC' if reverse else 'ASC'
+    sql += (f' ORDER BY score {direction}, rowid {direction}'
+            ' LIMIT %s OFFSET %s')
+    params += [-1 if limit is None else limit, offset]
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        return db_cursor.fetchall()
+
+
+def matching_ids_sql(match):
+    """SQL и параметры подзапроса id постов, например для pk__in."""
+    return (f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [match])
@@ -0,0 +1,120 @@
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import feed_cache, media, search, thumbnails, timeline
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow, Group,
+                     Post, Tombstone, User, UserStats)
+from .stats import bump
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    # У нового пользователя все счётчики нулевые — пересчёт не нужен
+    if created and not raw:
+        UserStats.objects.create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def post_moving(sender, instance, raw=False, **kwargs):
+    instance.old_image = None
+    if instance.pk and not raw:
+        old_group_id, instance.old_image = Post.objects.filter(
+            pk=instance.pk).values_list('group_id', 'image').first() or (
+            None, None)
+        if old_group_id and old_group_id != instance.group_id:
+            feed_cache.bump(f'group:{old_group_id}')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    feed_cache.bump(*feed_cache.post_scopes(instance))
+    search.index_post(instance)
+    if instance.image.name != instance.old_image:
+        media.retain(instance.image.name)
+        media.release(instance.old_image)
+    thumbnails.warm(instance)
+    if created:
+        bump(instance.author_id, 'posts_count', 1)
+        follower_ids = timeline.fan_out(instance)
+    else:
+        follower_ids = timeline.reader_ids(instance)
+    feed_cache.bump(*(f'follow:{user_id}' for user_id in follower_ids))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump(instance.author_id, 'posts_count', -1)
+    Tombstone.objects.create(kind='posts', object_id=instance.pk)
+    search.unindex_post(instance.pk)
+    media.release(instance.image.name)
+    feed_cache.bump(*feed_cache.post_scopes(instance))
+    feed_cache.bump(*(f'follow:{user_id}'
+                      for user_id in timeline.reader_ids(instance)))
+
+
+@receiver(post_delete, sender=ArchivedPost)
+def archived_post_deleted(sender, instance, **kwargs):
+    bump(instance.author_id, 'posts_count', -1)
+    Tombstone.objects.create(kind='posts', object_id=instance.pk)
+    search.unindex_post(instance.pk)
+    media.release(instance.image.name)
+    feed_cache.bump(*feed_cache.post_scopes(instance))
+
+
+@receiver(post_delete, sender=ArchivedComment)
+def archived_comment_deleted(sender, instance, **kwargs):
+    bump(instance.author_id, 'comments_count', -1)
+    Tombstone.objects.create(kind='comments', object_id=instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.reindex_group(instance.pk, instance.title)
+        feed_cache.bump(f'group:{instance.pk}')
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # Посты останутся без группы (SET_NULL) — убираем её название заранее
+    search.reindex_group(instance.pk, '')
+    feed_cache.bump(f'group:{instance.pk}')
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump(instance.author_id, 'comments_count', 1)
+        feed_cache.bump(*feed_cache.comment_scopes(instance.post))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    bump(instance.author_id, 'comments_count', -1)
+    Tombstone.objects.create(kind='comments', object_id=instance.pk)
+    feed_cache.bump(*feed_cache.comment_scopes(instance.post))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump(instance.author_id, 'followers_count', 1)
+        bump(instance.user_id, 'following_count', 1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        feed_cache.bump(f'follow:{instance.user_id}',
+                        f'profile:{instance.user_id}',
+                        f'profile:{instance.author_id}')
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    bump(instance.author_id, 'followers_count', -1)
+    bump(instance.user_id, 'following_count', -1)
+    Tombstone.objects.create(kind='follows', object_id=instance.pk)
+    timeline.drop_author(instance.user_id, instance.author_id)
+    feed_cache.bump(f'follow:{instance.user_id}',
+                    f'profile:{instance.user_id}',
+                    f'profile:{instance.author_id}')
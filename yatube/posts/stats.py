@@ -0,0 +1,45 @@
+from django.db.models import F
+
+from .models import (ArchivedComment, ArchivedPost, Comment, Follow, Post,
+                     UserStats)
+
+
+def count_for(user_id):
+    """Честный пересчёт счётчиков пользователя по таблицам.
+
+    Посты и комментарии в архиве тоже считаются.
+    """
+    return {
+        'posts_count': (
+            Post.objects.filter(author_id=user_id).count()
+            + ArchivedPost.objects.filter(author_id=user_id).count()),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+        'comments_count': (
+            Comment.objects.filter(author_id=user_id).count()
+            + ArchivedComment.objects.filter(author_id=user_id).count()),
+    }
+
+
+def recount(user_id):
+    stats, _ = UserStats.objects.update_or_create(
+        user_id=user_id, defaults=count_for(user_id))
+    return stats
+
+
+def bump(user_id, field, delta):
+    """Атомарно сдвигает счётчик; строка без истории создаётся пересчётом."""
+    rows = UserStats.objects.filter(user_id=user_id)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    updated = rows.update(**{field: F(field) + delta})
+    if not updated and delta > 0:
+        recount(user_id)
+
+
+def stats_for(user):
+    """Счётчики пользователя, загруженные через select_related('stats')."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return recount(user.pk)
@@ -0,0 +1,44 @@
+from django import template
+
+from posts import feed_cache, thumbnails
+
+register = template.Library()
+
+
+class FeedCacheNode(template.Node):
+    def __init__(self, nodelist, key):
+        self.nodelist = nodelist
+        self.key = key
+
+    def render(self, context):
+        return feed_cache.get_or_render(
+            self.key.resolve(context),
+            lambda: self.nodelist.render(context),
+        )
+
+
+@register.tag
+def feedcache(parser, token):
+    """{% feedcache feed_key %}...{% endfeedcache %}
+
+    Кэширует фрагмент ленты под ключом из feed_cache.page_key.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' принимает ровно один аргумент: ключ ленты")
+    nodelist = parser.parse(('endfeedcache',))
+    parser.delete_first_token()
+    return FeedCacheNode(nodelist, parser.compile_filter(bits[1]))
+
+
+@register.simple_tag
+def post_cards(posts):
+    """{% post_cards page_obj as cards %} — HTML карточек из кэша."""
+    return feed_cache.render_cards(posts)
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_picture(post):
+    """{% post_picture post %} — <picture> с вариантами картинки поста."""
+    return {'picture': thumbnails.picture(post)}
@@ -0,0 +1,177 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Follow,
+                          Group, Post, TimelineEntry)
+from posts.stats import count_for
+
+User = get_user_model()
+
+OLD_POSTS = 12
+NEW_POSTS = 5
+
+
+class ArchiveTest(TestCase):
+    """Перенос старых постов в архив и чтение лент поверх двух таблиц"""
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Группа', slug='archive', description='Описание')
+        Follow.objects.create(user=self.reader, author=self.author)
+        old = timezone.now() - timedelta(days=400)
+        for number in range(OLD_POSTS + NEW_POSTS):
+            post = Post.objects.create(author=self.author, group=self.group,
+                                       text=f'Пост номер {number}')
+            if number < OLD_POSTS:
+                Post.objects.filter(pk=post.pk).update(
+                    pub_date=old + timedelta(hours=number))
+        self.old_post = Post.objects.order_by('pub_date').first()
+        Comment.objects.create(post=self.old_post, author=self.reader,
+                               text='Старый комментарий')
+        self.expected = list(Post.objects.values_list('pk', flat=True))
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_posts', '--batch', '5', *args, stdout=out)
+        return out.getvalue()
+
+    def walk(self, client, url):
+        """id постов ленты, пролистанной курсорами до конца и обратно."""
+        page = client.get(url).context['page_obj']
+        pages = [page]
+        while page.has_next():
+            page = client.get(url, {'after': page.next_cursor}).context[
+                'page_obj']
+            pages.append(page)
+        back = client.get(url, {'before': page.previous_cursor}).context[
+            'page_obj']
+        self.assertEqual([post.pk for post in back],
+                         [post.pk for post in pages[-2]])
+        return [post.pk for page in pages for post in page]
+
+    def test_moves_old_posts_with_comments(self):
+        """Старые посты и их комментарии переезжают, счётчики те же."""
+        stats = count_for(self.author.pk)
+        self.assertIn('Перенесено в архив: 12', self.archive())
+        self.assertEqual(Post.objects.count(), NEW_POSTS)
+        self.assertEqual(ArchivedPost.objects.count(), OLD_POSTS)
+        self.assertFalse(Comment.objects.exists())
+        archived = ArchivedComment.objects.get()
+        self.assertEqual(archived.post_id, self.old_post.pk)
+        self.assertFalse(TimelineEntry.objects.filter(
+            post_id=self.old_post.pk).exists())
+        self.assertEqual(count_for(self.author.pk), stats)
+
+    def test_dry_run_moves_nothing_and_reports(self):
+        """--dry-run только считает и показывает размер таблицы."""
+        output = self.archive('--dry-run')
+        self.assertIn('К переносу: 12', output)
+        self.assertIn('posts_post:', output)
+        self.assertIn('post_author_date_idx', output)
+        self.assertFalse(ArchivedPost.objects.exists())
+
+    def test_feeds_continue_into_archive(self):
+        """Ленты листаются из горячей таблицы в архив без пропусков."""
+        self.archive()
+        feeds = [
+            (Client(), reverse('posts:index')),
+            (Client(), reverse('posts:group_list', args=['archive'])),
+            (Client(), reverse('posts:profile', args=['author'])),
+            (self.reader_client, reverse('posts:follow_index')),
+        ]
+        for client, url in feeds:
+            with self.subTest(url=url):
+                self.assertEqual(self.walk(client, url), self.expected)
+
+    @override_settings(TIMELINE_MAX_ENTRIES=3, TIMELINE_FANOUT_THRESHOLD=1)
+    def test_follow_feed_reads_hot_posts_beyond_timeline(self):
+        """За обрезанной лентой идут горячие посты подписок, потом архив;
+        посты «тяжёлого» автора встают между ними по дате."""
+        popular = User.objects.create_user(username='popular')
+        Follow.objects.create(user=self.reader, author=popular)
+        Follow.objects.create(user=self.author, author=popular)
+        newest = Post.objects.latest('pub_date', 'pk').pub_date
+        for number in range(15):
+            post = Post.objects.create(author=popular,
+                                       text=f'Громкий {number}')
+            Post.objects.filter(pk=post.pk).update(
+                pub_date=newest - timedelta(minutes=number))
+        expected = list(Post.objects.order_by('-pub_date', '-pk')
+                        .values_list('pk', flat=True))
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.archive()
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(
+            self.walk(self.reader_client, reverse('posts:follow_index')),
+            expected)
+
+    def test_legacy_page_past_hot_table(self):
+        """?page=N за горячей таблицей читает архив, за концом ленты — 404."""
+        self.archive()
+        feeds = [
+            (Client(), reverse('posts:index')),
+            (self.reader_client, reverse('posts:follow_index')),
+        ]
+        for client, url in feeds:
+            with self.subTest(url=url):
+                page = client.get(url, {'page': 2}).context['page_obj']
+                self.assertEqual([post.pk for post in page],
+                                 self.expected[10:])
+                self.assertTrue(all(post.archived for post in page))
+                self.assertEqual(
+                    client.get(url, {'page': 3}).status_code, 404)
+
+    def test_first_page_reads_only_hot_table(self):
+        """Полная первая страница не трогает архив."""
+        self.archive('--days', '0')
+        for number in range(10):
+            Post.objects.create(author=self.author, text=f'Свежий {number}')
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(any(post.archived
+                             for post in response.context['page_obj']))
+        self.assertTrue(response.context['page_obj'].has_next())
+
+    def test_post_detail_resolves_archived_id(self):
+        """Архивный пост открывается по старому id, только для чтения."""
+        self.archive()
+        client = Client()
+        client.force_login(self.author)
+        response = client.get(
+            reverse('posts:post_detail', args=[self.old_post.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['post'].archived)
+        self.assertContains(response, 'Старый комментарий')
+        self.assertNotContains(
+            response, reverse('posts:add_comment', args=[self.old_post.pk]))
+        self.assertNotContains(
+            response, reverse('posts:post_edit', args=[self.old_post.pk]))
+
+    def test_search_finds_archived_posts(self):
+        """Поиск находит посты в обеих таблицах."""
+        self.archive()
+        response = Client().get(reverse('posts:search'), {'q': 'номер'})
+        self.assertEqual(
+            sorted(post.pk for post in response.context['page_obj']),
+            sorted(self.expected)[:10])
+
+    def test_deleting_archived_post_updates_stats(self):
+        """Удаление архивного поста уменьшает счётчик автора."""
+        self.archive()
+        ArchivedPost.objects.filter(pk=self.old_post.pk).delete()
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.posts_count,
+                         OLD_POSTS + NEW_POSTS - 1)
+        self.assertEqual(count_for(self.author.pk)['posts_count'],
+                         OLD_POSTS + NEW_POSTS - 1)
@@ -0,0 +1,125 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from posts import exporter
+from posts.models import ArchivedPost, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ExportTest(TestCase):
+    """Потоковая выгрузка manage.py export_yatube"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Коты', slug='cats', description='Про котов')
+        self.posts = [Post.objects.create(author=self.author,
+                                          group=self.group,
+                                          text=f'Пост {number}')
+                      for number in range(5)]
+        Comment.objects.create(post=self.posts[0], author=self.reader,
+                               text='Мяу')
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def export(self, *args):
+        call_command('export_yatube', self.directory, '--chunk', '2', *args,
+                     stdout=StringIO())
+
+    def read(self, kind):
+        """Записи самой свежей выгрузки kind."""
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(f'{kind}-'))
+        with gzip.open(os.path.join(self.directory, names[-1]), 'rt',
+                       encoding='utf-8') as source:
+            return [json.loads(line) for line in source]
+
+    def test_exports_every_model_in_import_format(self):
+        """Ссылки выгружаются по username и slug, как ждёт импорт."""
+        self.export()
+        posts = self.read('posts')
+        self.assertEqual([post['id'] for post in posts],
+                         [post.pk for post in self.posts])
+        self.assertEqual(posts[0]['author'], 'author')
+        self.assertEqual(posts[0]['group'], 'cats')
+        self.assertFalse(posts[0]['archived'])
+        self.assertEqual(self.read('comments')[0]['post'], self.posts[0].pk)
+        self.assertEqual(self.read('follows')[0]['user'], 'reader')
+        self.assertEqual(self.read('groups')[0]['slug'], 'cats')
+
+    def test_scan_reads_table_in_chunks(self):
+        """Таблица читается запросами по chunk строк."""
+        with self.assertNumQueries(4):
+            rows = list(exporter.scan(Post.objects.all(),
+                                      exporter.FIELDS['posts'], 2))
+        self.assertEqual(len(rows), 5)
+
+    def test_incremental_export_takes_only_changes(self):
+        """--incremental выгружает только новое после прошлой выгрузки."""
+        self.export()
+        edited = self.posts[1]
+        edited.text = 'Исправленный пост'
+        edited.save()
+        new_follow = Follow.objects.create(user=self.author,
+                                           author=self.reader)
+        for name in os.listdir(self.directory):
+            if name.endswith('.gz'):
+                os.remove(os.path.join(self.directory, name))
+        self.export('--incremental')
+        self.assertEqual([post['id'] for post in self.read('posts')],
+                         [edited.pk])
+        self.assertEqual(self.read('comments'), [])
+        self.assertEqual([follow['id'] for follow in self.read('follows')],
+                         [new_follow.pk])
+        self.assertEqual(len(self.read('groups')), 1)
+
+    def test_incremental_export_marks_deletions(self):
+        """Удалённые после прошлой выгрузки строки приходят отметками,
+        перенос в архив удалением не считается."""
+        self.export()
+        comment_id = Comment.objects.get().pk
+        follow = Follow.objects.get()
+        follow_id = follow.pk
+        deleted = [post.pk for post in self.posts[:2]]
+        self.posts[0].delete()
+        follow.delete()
+        call_command('archive_posts', '--days', '0', stdout=StringIO())
+        ArchivedPost.objects.get(pk=deleted[1]).delete()
+        self.export('--incremental')
+        self.assertEqual(
+            sorted(record['id'] for record in self.read('deleted-posts')),
+            deleted)
+        self.assertEqual(
+            [record['id'] for record in self.read('deleted-comments')],
+            [comment_id])
+        self.assertEqual(
+            [record['id'] for record in self.read('deleted-follows')],
+            [follow_id])
+        self.export('--incremental')
+        self.assertEqual(self.read('deleted-posts'), [])
+
+    def test_exports_in_one_second_do_not_overwrite(self):
+        """Имя файла выгрузки различает выгрузки в одну секунду."""
+        self.export('--models', 'groups')
+        self.export('--models', 'groups')
+        self.assertEqual(len([name for name in os.listdir(self.directory)
+                              if name.startswith('groups-')]), 2)
+
+    def test_archived_rows_are_exported(self):
+        """Посты из архива попадают в ту же выгрузку с пометкой."""
+        call_command('archive_posts', '--days', '0', stdout=StringIO())
+        self.export('--models', 'posts', 'comments')
+        posts = self.read('posts')
+        self.assertEqual(len(posts), 5)
+        self.assertTrue(all(post['archived'] for post in posts))
+        self.assertEqual(self.read('comments')[0]['text'], 'Мяу')
@@ -84,12 +84,11 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(Post.objects.count(), posts_count)
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual(Post.objects.latest('pk').text, form_data['text'])
-        self.assertTrue(
-            Post.objects.filter(
-                text=form_data['text'],
-                group=form_data['group'],
-                image='posts/small_for_create.gif'
-            ).first()
+        # Файл назван по SHA-256 содержимого и лежит в шарде
+        self.assertRegex(
+            Post.objects.get(text=form_data['text'],
+                             group=form_data['group']).image.name,
+            r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.gif$'
         )
 
     def test_post_edit(self):
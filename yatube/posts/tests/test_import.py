@@ -0,0 +1,222 @@
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts import importer
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Follow,
+                          Group, ImportProgress, Post)
+
+User = get_user_model()
+
+OLD_DATE = datetime(2015, 3, 1, 12, 0, tzinfo=timezone.utc)
+NEW_DATE = datetime.now(timezone.utc)
+
+
+def index_names(model):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                       'AND tbl_name = %s', [model._meta.db_table])
+        return {row[0] for row in cursor.fetchall()}
+
+
+class ImportTest(TestCase):
+    """Пакетная загрузка manage.py import_yatube"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, records):
+        path = os.path.join(self.directory, name)
+        if name.endswith('.csv'):
+            with open(path, 'w', newline='', encoding='utf-8') as target:
+                writer = csv.DictWriter(target, fieldnames=list(records[0]))
+                writer.writeheader()
+                writer.writerows(records)
+            return path
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as target:
+            for record in records:
+                target.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return path
+
+    def load(self, kind, path, *args):
+        out = StringIO()
+        call_command('import_yatube', kind, path, '--batch', '2', *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def load_community(self, *args):
+        self.load('users', self.write('users.csv', [
+            {'username': 'author', 'first_name': 'Лев'},
+            {'username': 'reader', 'first_name': ''},
+        ]))
+        self.load('groups', self.write('groups.jsonl', [
+            {'slug': 'cats', 'title': 'Коты', 'description': 'Про котов'},
+        ]))
+        posts = [{'id': 100 + number, 'author': 'author', 'group': 'cats',
+                  'text': f'Старый пост {number}',
+                  'pub_date': OLD_DATE.replace(day=number + 1).isoformat()}
+                 for number in range(5)]
+        posts.append({'id': 200, 'author': 'nobody', 'text': 'Чужой',
+                      'pub_date': OLD_DATE.isoformat()})
+        output = self.load('posts', self.write('posts.jsonl.gz', posts),
+                           *args)
+        self.load('comments', self.write('comments.jsonl', [
+            {'id': 7, 'post': 100, 'author': 'reader', 'text': 'Мяу',
+             'created': OLD_DATE.isoformat()},
+            {'post': 100, 'author': 'reader', 'text': 'Без id'},
+            {'post': 999, 'author': 'reader', 'text': 'Потерянный'},
+        ]))
+        self.load('follows', self.write('follows.jsonl', [
+            {'user': 'reader', 'author': 'author'},
+            {'user': 'reader', 'author': 'author'},
+        ]))
+        return output
+
+    def test_loads_community_with_original_dates(self):
+        """Даты из выгрузки сохраняются, ссылки разрешаются по именам."""
+        output = self.load_community()
+        self.assertIn('нет пользователя (author): 1', output)
+        self.assertEqual(ArchivedPost.objects.count(), 5)
+        post = ArchivedPost.objects.get(pk=100)
+        self.assertEqual(post.pub_date, OLD_DATE)
+        self.assertEqual(post.updated, OLD_DATE)
+        self.assertEqual(post.group, Group.objects.get(slug='cats'))
+        self.assertEqual(ArchivedComment.objects.get(pk=7).created, OLD_DATE)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(User.objects.get(username='author').first_name,
+                         'Лев')
+
+    def test_finishes_what_signals_would_do(self):
+        """Счётчики, поиск и ленты подписок готовы после загрузки."""
+        self.load_community()
+        author = User.objects.get(username='author')
+        reader = User.objects.get(username='reader')
+        self.assertEqual(author.stats.posts_count, 5)
+        self.assertEqual(reader.stats.comments_count, 1)
+        self.assertEqual(author.stats.followers_count, 1)
+        client = Client()
+        client.force_login(reader)
+        response = client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 5)
+        response = Client().get(reverse('posts:search'), {'q': 'старый'})
+        self.assertEqual(len(response.context['page_obj']), 5)
+
+    def test_old_posts_go_to_archive(self):
+        """Посты старше ARCHIVE_AFTER_DAYS уходят в архив: лента не
+        перескакивает от горячих постов к старым и обратно."""
+        self.load_community()
+        self.load('posts', self.write('more.jsonl', [
+            {'author': 'author', 'text': 'Свежий',
+             'pub_date': NEW_DATE.isoformat()},
+            {'author': 'author', 'text': 'Совсем старый',
+             'pub_date': OLD_DATE.replace(year=2010).isoformat()},
+        ]))
+        self.assertEqual(list(Post.objects.values_list('text', flat=True)),
+                         ['Свежий'])
+        response = Client().get(reverse('posts:index'))
+        old = [f'Старый пост {number}' for number in range(4, -1, -1)]
+        self.assertEqual(
+            [post.text for post in response.context['page_obj']],
+            ['Свежий', *old, 'Совсем старый'])
+
+    def test_defer_indexes_rebuilds_them(self):
+        """--defer-indexes снимает индексы и строит их заново в конце."""
+        before = index_names(Post)
+        with mock.patch.object(importer, 'restore_indexes',
+                               wraps=importer.restore_indexes) as restore:
+            self.load_community('--defer-indexes')
+        dropped = restore.call_args[0][0]
+        self.assertTrue(any('post_author_date_idx' in sql for sql in dropped))
+        self.assertEqual(index_names(Post), before)
+
+    def test_resume_skips_committed_records(self):
+        """--resume продолжает с записи из таблицы прогресса."""
+        self.load('users', self.write('users.jsonl', [
+            {'username': 'author'}]))
+        path = self.write('posts.jsonl', [
+            {'id': number, 'author': 'author', 'text': f'Пост {number}',
+             'pub_date': NEW_DATE.isoformat()} for number in range(1, 6)])
+        ImportProgress.objects.create(source=os.path.abspath(path),
+                                      kind='posts', done=3)
+        output = self.load('posts', path, '--resume')
+        self.assertIn('Продолжаем с записи 3', output)
+        self.assertEqual(sorted(Post.objects.values_list('pk', flat=True)),
+                         [4, 5])
+        self.assertFalse(ImportProgress.objects.exists())
+
+    def test_resume_after_crash_does_not_duplicate(self):
+        """Прогресс пишется вместе с пачкой: после сбоя записи без id
+        не загружаются второй раз."""
+        self.load('users', self.write('users.jsonl', [
+            {'username': 'author'}]))
+        path = self.write('posts.jsonl', [
+            {'author': 'author', 'text': f'Пост {number}',
+             'pub_date': NEW_DATE.isoformat()} for number in range(5)])
+        save = importer.Importer.save
+        calls = []
+
+        def crash_on_second_batch(loader, objects):
+            calls.append(len(objects))
+            if len(calls) == 2:
+                raise RuntimeError('сбой')
+            return save(loader, objects)
+
+        with mock.patch.object(importer.Importer, 'save',
+                               crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.load('posts', path)
+        self.assertEqual(ImportProgress.objects.get().done, 2)
+        self.load('posts', path, '--resume')
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)),
+            [f'Пост {number}' for number in range(5)])
+
+    def test_bad_records_are_skipped_with_reason(self):
+        """Запись без обязательного поля или с неверным значением
+        пропускается, остальные загружаются."""
+        self.load('users', self.write('users.jsonl', [
+            {'username': 'author'}, {'first_name': 'Безымянный'}]))
+        output = self.load('posts', self.write('posts.jsonl', [
+            {'author': 'author', 'pub_date': NEW_DATE.isoformat()},
+            {'text': 'Без автора', 'pub_date': NEW_DATE.isoformat()},
+            {'id': 'x', 'author': 'author', 'text': 'Неверный id',
+             'pub_date': NEW_DATE.isoformat()},
+            {'author': 'author', 'text': 'Целый',
+             'pub_date': NEW_DATE.isoformat()},
+        ]))
+        self.assertEqual(list(Post.objects.values_list('text', flat=True)),
+                         ['Целый'])
+        self.assertIn('нет поля text: 1', output)
+        self.assertIn('нет поля author: 1', output)
+        self.assertIn('неверное значение: 1', output)
+        self.assertEqual(list(User.objects.values_list('username',
+                                                       flat=True)),
+                         ['author'])
+
+    def test_broken_line_fails_with_its_number(self):
+        """Битая строка JSONL останавливает загрузку с номером строки,
+        прогресс пачек до неё сохраняется."""
+        self.load('users', self.write('users.jsonl', [
+            {'username': 'author'}]))
+        path = self.write('posts.jsonl', [
+            {'author': 'author', 'text': f'Пост {number}',
+             'pub_date': NEW_DATE.isoformat()} for number in range(3)])
+        with open(path, 'a', encoding='utf-8') as target:
+            target.write('{"author": "author",\n')
+        with self.assertRaisesMessage(CommandError, 'строка 4'):
+            self.load('posts', path)
+        self.assertEqual(ImportProgress.objects.get().done, 2)
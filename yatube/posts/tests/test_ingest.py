@@ -0,0 +1,93 @@
+from io import BytesIO
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from posts.forms import PostForm
+
+
+def upload(name, size, image_format, **save_options):
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(
+        buffer, image_format, **save_options)
+    return SimpleUploadedFile(name, buffer.getvalue(),
+                              f'image/{image_format.lower()}')
+
+
+@override_settings(IMAGE_UPLOAD_MAX_BYTES=1024 * 1024,
+                   IMAGE_MAX_PIXELS=4 * 10 ** 6,
+                   IMAGE_MAX_SIDE=200,
+                   IMAGE_DECODE_MEMORY=2 * 1024 * 1024)
+class ImageIngestTest(TestCase):
+    """Картинка поста проверяется по заголовку и пережимается"""
+
+    def clean(self, image):
+        form = PostForm(data={'text': 'Пост'}, files={'image': image})
+        return form, form.is_valid()
+
+    def test_large_jpeg_is_drafted_and_downscaled(self):
+        exif = Image.Exif()
+        exif[0x0110] = 'Camera'
+        form, valid = self.clean(upload('big.jpg', (1600, 800), 'JPEG',
+                                        exif=exif.tobytes()))
+        self.assertTrue(valid, form.errors)
+        image = form.cleaned_data['image']
+        self.assertEqual(image.name, 'big.jpg')
+        with Image.open(image) as result:
+            self.assertEqual(result.size, (200, 100))
+            self.assertNotIn('exif', result.info)
+
+    def test_png_exif_is_stripped(self):
+        exif = Image.Exif()
+        exif[0x0110] = 'Camera'
+        form, valid = self.clean(upload('small.png', (40, 20), 'PNG',
+                                        exif=exif.tobytes()))
+        self.assertTrue(valid, form.errors)
+        with Image.open(form.cleaned_data['image']) as result:
+            self.assertEqual(result.size, (40, 20))
+            self.assertNotIn('exif', result.info)
+
+    def test_too_many_pixels_rejected_before_decoding(self):
+        image = upload('bomb.png', (2500, 2000), 'PNG')
+        with mock.patch.object(Image.Image, 'load',
+                               side_effect=AssertionError('декодирован')):
+            form, valid = self.clean(image)
+        self.assertFalse(valid)
+        self.assertEqual(form.errors.as_data()['image'][0].code,
+                         'too_many_pixels')
+
+    def test_decode_memory_is_capped(self):
+        # PNG не умеет draft: 1000x500 RGB дважды — больше 2 МБ
+        form, valid = self.clean(upload('wide.png', (1000, 500), 'PNG'))
+        self.assertFalse(valid)
+        self.assertEqual(form.errors.as_data()['image'][0].code,
+                         'too_large_to_decode')
+
+    def test_file_size_limit(self):
+        image = upload('huge.png', (10, 10), 'PNG')
+        image.size = 2 * 1024 * 1024
+        form, valid = self.clean(image)
+        self.assertFalse(valid)
+        self.assertEqual(form.errors.as_data()['image'][0].code,
+                         'file_too_large')
+
+    def test_unwritable_format_is_reencoded_to_png(self):
+        """XPM Pillow читает, но не пишет: картинка станет PNG."""
+        xpm = (b'/* XPM */\nstatic char *x[] = {\n"2 2 2 1",\n'
+               b'"a c #FF0000",\n"b c #0000FF",\n"ab",\n"ba"};\n')
+        form, valid = self.clean(
+            SimpleUploadedFile('icon.xpm', xpm, 'image/x-xpixmap'))
+        self.assertTrue(valid, form.errors)
+        image = form.cleaned_data['image']
+        self.assertEqual(image.name, 'icon.png')
+        with Image.open(image) as result:
+            self.assertEqual((result.format, result.size), ('PNG', (2, 2)))
+
+    def test_broken_image_data_rejected(self):
+        buffer = BytesIO()
+        Image.new('RGB', (50, 50)).save(buffer, 'PNG')
+        form, valid = self.clean(SimpleUploadedFile(
+            'broken.png', buffer.getvalue()[:60], 'image/png'))
+        self.assertFalse(valid)
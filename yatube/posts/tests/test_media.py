@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.storage import media_storage
+from posts.models import MediaFile, Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedMediaTest(TestCase):
+    """Картинки хранятся по хешу содержимого, один файл на все посты"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def create(self, filename='meme.gif'):
+        return Post.objects.create(
+            author=self.author, text='Мем',
+            image=SimpleUploadedFile(filename, SMALL_GIF, 'image/gif'))
+
+    def refs(self, name):
+        return MediaFile.objects.get(name=name).refs
+
+    def test_same_content_is_stored_once(self):
+        first = self.create('meme.gif')
+        second = self.create('MEME-copy.GIF')
+        self.assertEqual(first.image.name, second.image.name)
+        directory, name = os.path.split(first.image.name)
+        self.assertEqual(directory, f'posts/{name[:2]}/{name[2:4]}')
+        self.assertEqual(
+            len(os.listdir(os.path.join(TEMP_MEDIA_ROOT, directory))), 1)
+        self.assertEqual(self.refs(first.image.name), 2)
+
+    def test_refs_follow_edits_and_deletes(self):
+        post = self.create()
+        name = post.image.name
+        other = media_storage.save('posts/other.txt', ContentFile(b'x'))
+        post.image = other
+        post.save()
+        self.assertEqual(self.refs(name), 0)
+        self.assertEqual(self.refs(other), 1)
+        post.delete()
+        self.assertEqual(self.refs(other), 0)
+
+    def test_gc_removes_only_unreferenced_files(self):
+        kept = self.create()
+        dropped = Post.objects.create(
+            author=self.author, text='Удалённый',
+            image=SimpleUploadedFile('other.gif', SMALL_GIF + b'\0',
+                                     'image/gif'))
+        orphan = media_storage.save('posts/orphan.gif',
+                                    ContentFile(b'orphan'))
+        dropped.delete()
+        call_command('gc_media', '--grace', '0', '--dry-run',
+                     stdout=StringIO())
+        self.assertTrue(media_storage.exists(dropped.image.name))
+        call_command('gc_media', '--grace', '0', stdout=StringIO())
+        self.assertTrue(media_storage.exists(kept.image.name))
+        self.assertFalse(media_storage.exists(dropped.image.name))
+        self.assertFalse(media_storage.exists(orphan))
+        self.assertFalse(
+            MediaFile.objects.filter(name=dropped.image.name).exists())
+
+    def test_gc_keeps_file_uploaded_again_before_its_post(self):
+        """Повторная загрузка без поста не теряет файл из-за gc_media"""
+        post = self.create()
+        name = post.image.name
+        post.delete()
+        MediaFile.objects.filter(name=name).update(
+            updated=timezone.now() - timedelta(days=1))
+        old = time.time() - 24 * 60 * 60
+        os.utime(media_storage.path(name), (old, old))
+        # Форма уже сохранила файл, пост ещё не создан
+        self.assertEqual(media_storage.save(
+            'posts/again.gif', ContentFile(SMALL_GIF)), name)
+        call_command('gc_media', stdout=StringIO())
+        self.assertTrue(media_storage.exists(name))
+        self.assertFalse(media_storage.exists(name + '.gc'))
+
+    def test_gc_recount_repairs_drift(self):
+        post = self.create()
+        MediaFile.objects.filter(name=post.image.name).update(refs=0)
+        call_command('gc_media', '--grace', '0', '--recount',
+                     stdout=StringIO())
+        self.assertTrue(media_storage.exists(post.image.name))
+        self.assertEqual(self.refs(post.image.name), 1)
+
+    def test_archived_posts_keep_their_files(self):
+        post = self.create()
+        call_command('archive_posts', '--days', '0', stdout=StringIO())
+        # Файл без строки счётчика: так выглядит загрузка без сигналов
+        MediaFile.objects.all().delete()
+        call_command('gc_media', '--grace', '0', stdout=StringIO())
+        self.assertTrue(media_storage.exists(post.image.name))
+        with mock.patch('posts.thumbnails.generate_in_thread') as generate:
+            call_command('warm_thumbnails', stdout=StringIO())
+        generate.assert_called_once_with(post.image.name)
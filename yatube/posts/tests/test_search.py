@@ -0,0 +1,110 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts import search
+from posts.models import Group, Post
+from posts.paginator import SearchPaginator
+
+User = get_user_model()
+
+
+def indexed_ids():
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT rowid FROM {search.FTS_TABLE}')
+        return {row[0] for row in cursor.fetchall()}
+
+
+class SearchTest(TestCase):
+    """Полнотекстовый поиск по постам"""
+    def setUp(self):
+        self.user = User.objects.create_user(username='author')
+        self.group = Group.objects.create(
+            title='Ёжики', slug='hedgehogs', description='Описание')
+        self.hedgehog = Post.objects.create(
+            author=self.user, group=self.group,
+            text='Ёжик нашёл в лесу грибы')
+        self.cats = Post.objects.create(
+            author=self.user, text='Кошки и коты спят весь день')
+
+    def search(self, query, **params):
+        response = Client().get(reverse('posts:search'),
+                                {'q': query, **params})
+        return list(response.context['page_obj'] or [])
+
+    def test_build_match_is_safe(self):
+        """Синтаксис FTS5 из ввода превращается в обычные слова."""
+        self.assertEqual(search.build_match('постами "OR" NEAR(*'),
+                         '"пост"* "or"* "near"*')
+        self.assertEqual(search.build_match(' ?! '), '')
+
+    def test_russian_forms_and_yo(self):
+        """Находятся другие формы слова, «ё» и «е» не различаются."""
+        self.assertEqual(self.search('ежики'), [self.hedgehog])
+        self.assertEqual(self.search('кошками'), [self.cats])
+        self.assertEqual(self.search('гриб лес'), [self.hedgehog])
+        self.assertEqual(self.search('гриб кот'), [])
+
+    def test_index_follows_signals(self):
+        """Правка, удаление поста и переименование группы видны в поиске."""
+        self.cats.text = 'Собаки гуляют'
+        self.cats.save()
+        self.assertEqual(self.search('кошки'), [])
+        self.assertEqual(self.search('собака'), [self.cats])
+        self.group.title = 'Лесные жители'
+        self.group.save()
+        self.assertEqual(self.search('жители'), [self.hedgehog])
+        self.group.delete()
+        self.assertEqual(self.search('жители'), [])
+        self.hedgehog.delete()
+        self.assertEqual(self.search('грибы'), [])
+
+    def test_bm25_ranking_and_cursor_pages(self):
+        """Лучшие совпадения первыми, страницы листаются курсором."""
+        for number in range(12):
+            Post.objects.create(author=self.user, text=f'Пост номер {number}')
+        best = Post.objects.create(author=self.user, text='Пост пост пост')
+        response = Client().get(reverse('posts:search'), {'q': 'пост'})
+        page = response.context['page_obj']
+        self.assertEqual(page[0], best)
+        self.assertTrue(page.has_next())
+        self.assertContains(response, 'q=%D0%BF%D0%BE%D1%81%D1%82&amp;after=')
+        second = self.search('пост', after=page.next_cursor)
+        self.assertEqual(len(second), 3)
+        self.assertFalse(set(second) & set(page))
+
+    def test_stale_index_rows_do_not_end_results(self):
+        """Строки индекса без поста не съедают конец страницы."""
+        for number in range(11):
+            Post.objects.create(author=self.user, text=f'Пост номер {number}')
+        stale = Post.objects.create(author=self.user, text='Пост пост пост')
+        # Пост исчез мимо сигналов, его строка в индексе осталась
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Post._meta.db_table} WHERE id = %s',
+                           [stale.pk])
+        paginator = SearchPaginator(search.build_match('пост'),
+                                    Post.objects.all())
+        page = paginator.get_page({})
+        self.assertEqual(len(page), 10)
+        self.assertTrue(page.has_next())
+        self.assertEqual(
+            len(paginator.get_page({'after': page.next_cursor})), 1)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(indexed_ids(), {self.hedgehog.pk, self.cats.pk})
+
+    def test_admin_uses_index(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        client = Client()
+        client.force_login(admin)
+        response = client.get('/admin/posts/post/', {'q': 'грибами'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.hedgehog])
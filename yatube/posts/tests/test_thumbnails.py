@@ -0,0 +1,129 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from posts import thumbnails
+from posts.models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class EagerThumbnailTest(TestCase):
+    """Миниатюры создаются заранее, отрисовка не вызывает Pillow"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(
+            author=cls.author, text='Пост с картинкой',
+            image=SimpleUploadedFile('thumb.gif', SMALL_GIF, 'image/gif'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:profile', kwargs={'username': 'author'})
+
+    def get_without_pillow(self):
+        with mock.patch('sorl.thumbnail.default.engine.get_image',
+                        side_effect=AssertionError('Pillow в отрисовке')):
+            return self.client.get(self.url)
+
+    def test_missing_thumbnail_is_queued_not_rendered(self):
+        with mock.patch('posts.thumbnails.enqueue') as enqueue:
+            first = self.get_without_pillow()
+            second = self.get_without_pillow()
+        enqueue.assert_called_with(self.post.image.name)
+        self.assertContains(first, self.post.image.url)
+        # Страница с исходной картинкой не закрепляется в кэше
+        self.assertEqual(second['X-Page-Cache'], 'MISS')
+
+    def test_generated_thumbnail_is_used(self):
+        thumbnails.generate(self.post.image.name)
+        response = self.get_without_pillow()
+        self.assertNotContains(response, f'src="{self.post.image.url}"')
+        self.assertContains(response, 'src="/media/cache/')
+        self.assertEqual(self.get_without_pillow()['X-Page-Cache'], 'HIT')
+
+    def test_failed_image_is_not_requeued_and_page_cached(self):
+        with mock.patch('posts.thumbnails.generate',
+                        side_effect=OSError('битый файл')):
+            with self.assertRaises(OSError):
+                thumbnails.generate_in_thread(self.post.image.name)
+        with mock.patch('posts.thumbnails.enqueue') as enqueue:
+            first = self.get_without_pillow()
+            second = self.get_without_pillow()
+        enqueue.assert_not_called()
+        self.assertContains(first, self.post.image.url)
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+
+    def test_warm_command_covers_every_image(self):
+        with mock.patch('posts.thumbnails.generate_in_thread') as generate:
+            call_command('warm_thumbnails', stdout=StringIO())
+        generate.assert_called_once_with(self.post.image.name)
+
+    def test_resolve_fetches_page_in_one_query(self):
+        posts = [self.post] + [
+            Post.objects.create(
+                author=self.author, text=f'Пост {number}',
+                image=SimpleUploadedFile(
+                    f'thumb{number}.gif', SMALL_GIF + bytes([number]),
+                    'image/gif'))
+            for number in range(3)]
+        for post in posts[:2]:
+            thumbnails.generate(post.image.name)
+        cache.clear()
+        with self.assertNumQueries(1):
+            thumbnails.resolve(posts)
+        # Записи и их отсутствие теперь в кэше kvstore
+        with self.assertNumQueries(0):
+            thumbnails.resolve(posts)
+        geometry, options = thumbnails.GEOMETRIES[0]
+        variant = (geometry, options['format'])
+        self.assertIsNotNone(posts[0].thumbnails[variant])
+        self.assertIsNone(posts[3].thumbnails[variant])
+        with mock.patch('posts.thumbnails.enqueue') as enqueue:
+            picture = thumbnails.picture(posts[3])
+        enqueue.assert_called_once_with(posts[3].image.name)
+        self.assertEqual(picture['src'].name, posts[3].image.name)
+        self.assertEqual(picture['srcset'], '')
+
+    def test_card_has_srcset_with_dimensions(self):
+        thumbnails.generate(self.post.image.name)
+        response = self.get_without_pillow()
+        for width in thumbnails.WIDTHS:
+            self.assertContains(response, f' {width}w')
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, f'sizes="{thumbnails.SIZES}"')
+
+    def test_feed_image_bytes_compares_variants(self):
+        thumbnails.generate(self.post.image.name)
+        out = StringIO()
+        call_command('feed_image_bytes', '--width', '480', stdout=out)
+        self.assertIn('без готовых вариантов: 0', out.getvalue())
+        self.assertIn('экономия:', out.getvalue())
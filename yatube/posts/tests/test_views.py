@@ -1,14 +1,23 @@
 import tempfile
+import threading
+import time
 import shutil
+from io import StringIO
+from unittest import mock
 from django import forms
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.urls import reverse
+from django.urls import resolve, reverse
 from django.conf import settings
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Group, Post, User, Comment, Follow
+from posts import feed_cache
+from posts.models import (Group, Post, User, Comment, Follow, TimelineEntry,
+                          UserStats)
 from ..forms import PostForm
 User = get_user_model()
 ITEMS_PER_PAGE = 10
@@ -179,18 +188,15 @@ class PostPagesTests(TestCase):
                 self.assertIsInstance(form_field, expected)
 
     def test_index_cache(self):
-        """ Получить текущее количество постов, создать новый пост,
-        запросить страницу с постами и проверить что там нет нового поста,
-        затем очистить кеш, снова запросить страницу с постами и увидеть,
-        что там появился пост.
+        """ Запросить главную страницу, изменить пост в обход сигналов,
+        запросить страницу снова и проверить, что она отдана из кэша,
+        затем очистить кеш и увидеть изменения.
         """
 
         posts_in_bd = self.guest_client.get(reverse('posts:index')).content
 
-        Post.objects.create(
-            text='Тестовый текст нового поста',
-            author=self.author,
-        )
+        Post.objects.filter(pk=self.post.pk).update(
+            text='Тестовый текст изменённого поста')
 
         posts_with_cache = self.guest_client.get(
             reverse('posts:index')).content
@@ -210,6 +216,36 @@ class PostPagesTests(TestCase):
             posts_without_cache,
             'Количество постов одинаково')
 
+    def test_index_cache_invalidated_by_new_post(self):
+        """Новый пост сразу виден на закэшированных страницах лент."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+        )
+        for url in urls:
+            self.guest_client.get(url)
+        Post.objects.create(
+            text='Тестовый текст нового поста',
+            author=self.author,
+            group=self.group,
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertContains(response, 'Тестовый текст нового поста')
+
+    def test_feed_cache_pages_are_separate(self):
+        """Разные страницы ленты кэшируются под разными ключами."""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Пост {number}')
+            for number in range(ITEMS_PER_PAGE))
+        first = self.guest_client.get(reverse('posts:index'))
+        second = self.guest_client.get(reverse('posts:index') + '?page=2')
+        self.assertNotEqual(first.content, second.content)
+        self.assertContains(second, self.post.text)
+
 
 class PaginatorViewsTest(TestCase):
     @classmethod
@@ -233,6 +269,10 @@ class PaginatorViewsTest(TestCase):
         ]
         cls.post = Post.objects.bulk_create(objs)
 
+    def setUp(self):
+        # bulk_create не шлёт сигналов и не вычищает кэш страниц
+        cache.clear()
+
     def test_first_page_contains_ten_records(self):
         """Проверка: на первой странице должно быть 10 постов."""
         response = self.client.get(reverse('posts:index'))
@@ -256,6 +296,39 @@ class PaginatorViewsTest(TestCase):
             'posts:profile', kwargs={'username': self.author.username}))
         self.assertEqual(len(response.context['page_obj']), ITEMS_PER_PAGE)
 
+    def test_cursor_pages_follow_each_other(self):
+        """Курсоры ?after= и ?before= листают ленту без пропусков."""
+        url = reverse('posts:group_list', kwargs={'slug': 'test_slug'})
+        first_page = self.client.get(url).context['page_obj']
+        second_page = self.client.get(
+            url, {'after': first_page.next_cursor}).context['page_obj']
+        self.assertEqual(second_page.number, 2)
+        self.assertEqual(len(second_page), ITEMS_PER_PAGE_3)
+        self.assertFalse(second_page.has_next())
+        self.assertEqual(
+            set(first_page) & set(second_page), set(),
+            'Страницы ленты пересекаются')
+        back_page = self.client.get(
+            url, {'before': second_page.previous_cursor}).context['page_obj']
+        self.assertEqual(back_page.number, 1)
+        self.assertEqual(list(back_page), list(first_page))
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        """Битый курсор открывает первую страницу."""
+        response = self.client.get(
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+            {'after': 'not-a-cursor'})
+        self.assertEqual(response.context['page_obj'].number, 1)
+
+    def test_cursor_page_does_not_count_rows(self):
+        """Лента не делает COUNT(*) по таблице постов."""
+        url = reverse('posts:group_list', kwargs={'slug': 'test_slug'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(
+            [q for q in queries if 'COUNT(*)' in q['sql'].upper()])
+
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -373,3 +446,616 @@ class FollowerTest(TestCase):
         follow = Follow.objects.filter(user=self.follow_user,
                                        author=self.user).exists()
         self.assertEqual(follow, False)
+
+    def test_timeline_filled_on_follow_and_post(self):
+        """Лента подписок заполняется при подписке и новых постах."""
+        self.follow_client.get(
+            reverse('posts:profile_follow', kwargs={'username': self.user}))
+        new_post = Post.objects.create(author=self.user, text='Новый пост')
+        response = self.follow_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']), [new_post, self.post])
+        self.follow_client.get(
+            reverse('posts:profile_unfollow', kwargs={'username': self.user}))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.follow_user).exists())
+
+    def test_timeline_not_filled_for_other_users(self):
+        """Пост не попадает в ленту тех, кто не подписан на автора."""
+        Post.objects.create(author=self.user, text='Новый пост')
+        response = self.follow_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+
+    def test_deep_legacy_page_is_not_found(self):
+        """Старый ?page=N дальше LEGACY_MAX_PAGE не читает префикс лент."""
+        Follow.objects.create(user=self.follow_user, author=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.follow_client.get(
+                reverse('posts:follow_index'), {'page': 100000})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(any('LIMIT' in query['sql']
+                             for query in queries.captured_queries))
+
+    @override_settings(TIMELINE_MAX_ENTRIES=2)
+    def test_timeline_trimmed_to_cap(self):
+        """В ленте хранится не больше TIMELINE_MAX_ENTRIES записей."""
+        Follow.objects.create(user=self.follow_user, author=self.user)
+        newest = [Post.objects.create(author=self.user, text=str(number))
+                  for number in range(3)][-2:]
+        entries = TimelineEntry.objects.filter(user=self.follow_user)
+        self.assertEqual(
+            [entry.post for entry in entries], newest[::-1])
+
+    @override_settings(TIMELINE_MAX_ENTRIES=2)
+    def test_fan_out_trims_all_followers_in_one_query(self):
+        """Обрезка лент при публикации не растёт с числом подписчиков."""
+        readers = [User.objects.create_user(username=f'reader{number}')
+                   for number in range(5)]
+        for reader in readers:
+            Follow.objects.create(user=reader, author=self.user)
+        for number in range(2):
+            Post.objects.create(author=self.user, text=str(number))
+        with CaptureQueriesContext(connection) as queries:
+            newest = Post.objects.create(author=self.user, text='Новый')
+        deletes = [query for query in queries.captured_queries
+                   if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
+        for reader in readers:
+            entries = TimelineEntry.objects.filter(user=reader)
+            self.assertEqual(entries.count(), 2)
+            self.assertEqual(entries.first().post, newest)
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_popular_author_merged_at_read_time(self):
+        """Посты автора выше порога не раскладываются, но есть в ленте."""
+        other_reader = User.objects.create_user(username='reader')
+        quiet_author = User.objects.create_user(username='quiet')
+        Follow.objects.create(user=self.follow_user, author=self.user)
+        Follow.objects.create(user=other_reader, author=self.user)
+        Follow.objects.create(user=self.follow_user, author=quiet_author)
+        pushed = Post.objects.create(author=quiet_author, text='Тихий пост')
+        pulled = Post.objects.create(author=self.user, text='Громкий пост')
+        self.assertFalse(
+            TimelineEntry.objects.filter(post=pulled).exists())
+        self.assertTrue(
+            TimelineEntry.objects.filter(post=pushed).exists())
+        response = self.follow_client.get(reverse('posts:follow_index'))
+        page = response.context['page_obj']
+        self.assertEqual(list(page), [pulled, pushed, self.post])
+        self.assertEqual(page.paginator.merge_stats['streams'], 2)
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_author_crossing_threshold_keeps_posts(self):
+        """Посты, опубликованные выше порога, не пропадают из ленты, когда
+        автор опускается ниже порога, и раскладываются после пересборки."""
+        other_reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=self.follow_user, author=self.user)
+        before = Post.objects.create(author=self.user, text='До порога')
+        Follow.objects.create(user=other_reader, author=self.user)
+        during = Post.objects.create(author=self.user, text='Выше порога')
+        self.assertFalse(TimelineEntry.objects.filter(post=during).exists())
+        Follow.objects.filter(user=other_reader).delete()
+        response = self.follow_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']),
+                         [during, before, self.post])
+
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.user.stats.refresh_from_db()
+        self.assertFalse(self.user.stats.pulled)
+        after = Post.objects.create(author=self.user, text='Ниже порога')
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.follow_user).count(), 4)
+        response = self.follow_client.get(reverse('posts:follow_index'))
+        page = response.context['page_obj']
+        self.assertEqual(list(page), [after, during, before, self.post])
+        self.assertEqual(page.paginator.merge_stats['streams'], 1)
+
+
+class UserStatsTest(TestCase):
+    """Денормализованные счётчики пользователя"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Текст')
+
+    def test_counters_follow_create_and_delete(self):
+        """Счётчики меняются при создании и удалении объектов."""
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        comment = Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий')
+        author_stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(
+            (author_stats.posts_count, author_stats.followers_count),
+            (1, 1))
+        reader_stats = UserStats.objects.get(user=self.reader)
+        self.assertEqual(
+            (reader_stats.following_count, reader_stats.comments_count),
+            (1, 1))
+        follow.delete()
+        comment.delete()
+        reader_stats.refresh_from_db()
+        self.assertEqual(
+            (reader_stats.following_count, reader_stats.comments_count),
+            (0, 0))
+
+    def test_profile_and_detail_do_not_count(self):
+        """Профиль и пост читают счётчики без COUNT-запросов."""
+        urls = (
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertFalse(
+                    [q for q in queries if 'COUNT(*)' in q['sql'].upper()])
+        self.assertEqual(response.context['post_number'], 1)
+
+    def test_recount_stats_repairs_drift(self):
+        """manage.py recount_stats исправляет разошедшиеся счётчики."""
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        call_command('recount_stats', stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 1)
+
+
+class FeedQueriesTest(TestCase):
+    """Число запросов ленты не зависит от числа постов на странице"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='queries', description='Описание')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def add_posts(self, count):
+        for number in range(Post.objects.count(),
+                            Post.objects.count() + count):
+            author = User.objects.create_user(username=f'author{number}')
+            Follow.objects.create(user=self.reader, author=author)
+            post = Post.objects.create(
+                author=author, group=self.group, text=f'Пост {number}')
+            Comment.objects.create(post=post, author=self.reader, text='Да')
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.reader_client.get(url)
+        return len(queries)
+
+    def test_feed_queries_do_not_depend_on_page_size(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'queries'}),
+            reverse('posts:follow_index'),
+        )
+        self.add_posts(1)
+        single = {url: self.count_queries(url) for url in urls}
+        self.add_posts(ITEMS_PER_PAGE - 1)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), single[url])
+
+    def test_feed_posts_have_comment_count(self):
+        self.add_posts(1)
+        response = self.reader_client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'][0].comment_count, 1)
+
+    def test_post_detail_queries_do_not_depend_on_comments(self):
+        self.add_posts(1)
+        post = Post.objects.get()
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        single = self.count_queries(url)
+        Comment.objects.bulk_create(
+            Comment(post=post, author=User.objects.create_user(f'c{number}'),
+                    text='Ещё') for number in range(5))
+        self.assertEqual(self.count_queries(url), single)
+
+
+class QueryBudgetTest(TestCase):
+    """Каждый URL приложения укладывается в свой бюджет SQL-запросов"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='budget', description='Описание')
+        for number in range(ITEMS_PER_PAGE + 1):
+            post = Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {number}')
+            Comment.objects.create(post=post, author=cls.reader, text='Да')
+        cls.post = post
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def requests(self):
+        post_id = {'post_id': self.post.pk}
+        author = {'username': self.author.username}
+        reader = {'username': self.reader.username}
+        return {
+            'index': ('get', reverse('posts:index'), {}),
+            'group_list': ('get', reverse(
+                'posts:group_list', kwargs={'slug': 'budget'}), {}),
+            'profile': ('get', reverse('posts:profile', kwargs=author), {}),
+            'post_detail': ('get', reverse(
+                'posts:post_detail', kwargs=post_id), {}),
+            'search': ('get', reverse('posts:search'), {'q': 'Пост'}),
+            'post_create': ('post', reverse('posts:post_create'),
+                            {'text': 'Новый', 'group': self.group.pk}),
+            'post_edit': ('post', reverse('posts:post_edit', kwargs=post_id),
+                          {'text': 'Правка', 'group': self.group.pk}),
+            'add_comment': ('post', reverse(
+                'posts:add_comment', kwargs=post_id), {'text': 'Ещё'}),
+            'follow_index': ('get', reverse('posts:follow_index'), {}),
+            'profile_follow': ('get', reverse(
+                'posts:profile_follow', kwargs=reader), {}),
+            'profile_unfollow': ('get', reverse(
+                'posts:profile_unfollow', kwargs=reader), {}),
+        }
+
+    def test_every_url_has_budget(self):
+        from posts.urls import urlpatterns
+        names = {pattern.name for pattern in urlpatterns}
+        self.assertEqual(names, set(self.requests()))
+        for pattern in urlpatterns:
+            with self.subTest(url=pattern.name):
+                self.assertIsNotNone(
+                    getattr(pattern.callback, 'query_budget', None))
+
+    def test_urls_stay_within_budget(self):
+        for name, (method, url, data) in self.requests().items():
+            with self.subTest(url=name):
+                if method == 'post':
+                    response = self.author_client.get(url)
+                    self.assertLessEqual(
+                        response.query_count,
+                        resolve(url).func.query_budget)
+                response = getattr(self.author_client, method)(url, data)
+                self.assertLessEqual(
+                    response.query_count, resolve(url).func.query_budget)
+
+
+class QueryPlanTest(TestCase):
+    """Запросы лент идут по индексам, без полного обхода и сортировки"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='plans', description='Описание')
+        for number in range(ITEMS_PER_PAGE + 1):
+            post = Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {number}')
+            Comment.objects.create(post=post, author=cls.reader, text='Да')
+        cls.post = post
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def plan_problems(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            details = [row[3] for row in cursor.fetchall()]
+        return [detail for detail in details
+                if 'TEMP B-TREE' in detail
+                or detail.startswith('SCAN ') and ' INDEX ' not in detail]
+
+    def test_views_use_indexes(self):
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'plans'}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:follow_index'),
+        ]
+        for url in urls:
+            page = self.client.get(url).context.get('page_obj')
+            pages = [url]
+            if page is not None and page.has_next():
+                pages.append(f'{url}?after={page.next_cursor}')
+            for page_url in pages:
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(page_url)
+                for query in queries.captured_queries:
+                    with self.subTest(url=page_url, sql=query['sql']):
+                        self.assertEqual(self.plan_problems(query['sql']),
+                                         [])
+
+
+class AnonymousPageCacheTest(TestCase):
+    """Кэш страниц для анонимов и его точечная очистка сигналами"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+        cls.group = Group.objects.create(
+            title='Группа', slug='cached', description='Описание')
+        cls.other_group = Group.objects.create(
+            title='Другая', slug='other', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост')
+        cls.other_post = Post.objects.create(
+            author=cls.other, group=cls.other_group, text='Другой пост')
+
+    def setUp(self):
+        cache.clear()
+        self.urls = {
+            'index': reverse('posts:index'),
+            'group': reverse('posts:group_list', kwargs={'slug': 'cached'}),
+            'other_group': reverse(
+                'posts:group_list', kwargs={'slug': 'other'}),
+            'profile': reverse(
+                'posts:profile', kwargs={'username': 'author'}),
+            'other_profile': reverse(
+                'posts:profile', kwargs={'username': 'other'}),
+            'detail': reverse(
+                'posts:post_detail', kwargs={'post_id': self.post.pk}),
+            'other_detail': reverse(
+                'posts:post_detail', kwargs={'post_id': self.other_post.pk}),
+        }
+        for url in self.urls.values():
+            self.client.get(url)
+
+    def cached(self):
+        return {name for name, url in self.urls.items()
+                if self.client.get(url)['X-Page-Cache'] == 'HIT'}
+
+    def test_hit_miss_and_age(self):
+        cache.clear()
+        first = self.client.get(self.urls['index'])
+        second = self.client.get(self.urls['index'])
+        self.assertEqual(first['X-Page-Cache'], 'MISS')
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+        self.assertEqual(second['Age'], '0')
+        self.assertEqual(second.content, first.content)
+
+    def test_write_during_render_is_not_cached_as_fresh(self):
+        cache.clear()
+        original = feed_cache.page_key
+
+        def page_key_with_write(request, scopes):
+            # Новый пост появился, пока страница рисовалась
+            feed_cache.bump('global')
+            return original(request, scopes)
+
+        with mock.patch('posts.views.page_key', page_key_with_write):
+            self.client.get(self.urls['index'])
+        self.assertEqual(
+            self.client.get(self.urls['index'])['X-Page-Cache'], 'MISS')
+        self.assertEqual(
+            self.client.get(self.urls['index'])['X-Page-Cache'], 'HIT')
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.force_login(self.author)
+        response = self.client.get(self.urls['index'])
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertEqual(response.context['user'], self.author)
+
+    def test_comment_purges_only_pages_with_post(self):
+        Comment.objects.create(post=self.post, author=self.other, text='Да')
+        self.assertEqual(self.cached(),
+                         {'other_group', 'other_profile', 'other_detail'})
+
+    def test_new_post_purges_its_feeds(self):
+        Post.objects.create(author=self.author, group=self.group, text='Ещё')
+        self.assertEqual(self.cached(),
+                         {'other_group', 'other_profile', 'other_detail'})
+
+    def test_follow_purges_both_profiles(self):
+        Follow.objects.create(user=self.other, author=self.author)
+        self.assertEqual(
+            self.cached(),
+            {'index', 'group', 'other_group', 'detail', 'other_detail'})
+
+
+class ConditionalGetTest(TestCase):
+    """ETag и Last-Modified считаются без выборки постов и отрисовки"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='etag', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.author)
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'etag'}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+
+    def revalidate(self, client, url):
+        response = client.get(url)
+        return client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_not_modified_without_render(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertTrue(first.has_header('Last-Modified'))
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+                self.assertFalse(any(
+                    'posts_comment' in query['sql']
+                    for query in queries.captured_queries))
+
+    def test_changes_give_new_etag(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.author, text='Да')
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user_and_page(self):
+        for number in range(ITEMS_PER_PAGE):
+            Post.objects.create(author=self.author, text=f'Пост {number}')
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        self.assertNotEqual(Client().get(url)['ETag'], etag)
+        self.assertNotEqual(self.client.get(url, {'page': 2})['ETag'], etag)
+
+    def test_cached_anonymous_page_revalidates(self):
+        client = Client()
+        url = reverse('posts:index')
+        client.get(url)
+        response = self.revalidate(client, url)
+        self.assertEqual(response.status_code, 304)
+
+
+class PostCardCacheTest(TestCase):
+    """Карточки постов кэшируются поштучно и общие для всех лент"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='cards', description='Описание')
+        cls.posts = [
+            Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {number}')
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def card_keys(self):
+        return {feed_cache.card_key(post)
+                for post in Post.objects.for_feed()}
+
+    def test_cards_shared_between_feeds(self):
+        self.client.get(reverse('posts:index'))
+        keys = self.card_keys()
+        self.assertEqual(len(cache.get_many(list(keys))), 3)
+        with self.assertTemplateNotUsed('posts/includes/post_card.html'):
+            self.client.get(
+                reverse('posts:group_list', kwargs={'slug': 'cards'}))
+
+    def test_edit_invalidates_only_its_card(self):
+        self.client.get(reverse('posts:index'))
+        old_keys = self.card_keys()
+        post = self.posts[0]
+        post.text = 'Исправленный пост'
+        post.save()
+        Comment.objects.create(
+            post=self.posts[1], author=self.author, text='Да')
+        new_keys = self.card_keys()
+        self.assertEqual(len(old_keys & new_keys), 1)
+        response = self.client.get(
+            reverse('posts:profile', kwargs={'username': 'author'}))
+        self.assertContains(response, 'Исправленный пост')
+        self.assertContains(response, 'Комментариев: 1')
+        self.assertEqual(
+            [template.name for template in response.templates].count(
+                'posts/includes/post_card.html'), 2)
+
+
+class FeedCacheStampedeTest(TestCase):
+    """Устаревший фрагмент ленты пересчитывает только один запрос"""
+    def setUp(self):
+        cache.clear()
+        self.renders = 0
+
+    def render(self, html='новый', pause=0):
+        def render():
+            self.renders += 1
+            time.sleep(pause)
+            return html
+        return render
+
+    def expire(self, key):
+        entry = cache.get(key.key)
+        entry['expires'] = time.time() - 1
+        cache.set(key.key, entry)
+
+    def test_single_flight_on_expiry(self):
+        key = feed_cache.FeedKey('feed:page:test', 'v1', 30)
+        feed_cache.get_or_render(key, self.render('старый'))
+        self.expire(key)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                feed_cache.get_or_render(key, self.render(pause=0.2))))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.renders, 2)
+        self.assertEqual(results.count('новый'), 1)
+        self.assertEqual(results.count('старый'), 7)
+
+    def test_new_version_served_stale_while_locked(self):
+        old = feed_cache.FeedKey('feed:page:test', 'v1', 30)
+        feed_cache.get_or_render(old, self.render('старый'))
+        new = old._replace(version='v2')
+        cache.add(feed_cache.LOCK_KEY.format(new.key), 1)
+        self.assertEqual(feed_cache.get_or_render(new, self.render()),
+                         'старый')
+        cache.delete(feed_cache.LOCK_KEY.format(new.key))
+        self.assertEqual(feed_cache.get_or_render(new, self.render()),
+                         'новый')
+
+    def test_no_stale_window_waits_then_renders(self):
+        key = feed_cache.FeedKey('feed:page:test', 'v1', 0)
+        cache.add(feed_cache.LOCK_KEY.format(key.key), 1)
+        with mock.patch.object(feed_cache, 'LOCK_WAIT', 0):
+            self.assertEqual(feed_cache.get_or_render(key, self.render()),
+                             'новый')
+
+    @override_settings(FEED_CACHE_STATS_FLUSH=3600)
+    def test_stats_batched_per_process(self):
+        feed_cache.flush_stats()
+        cache.clear()
+        key = feed_cache.FeedKey('feed:page:test', 'v1', 30)
+        for _ in range(3):
+            feed_cache.get_or_render(key, self.render())
+        self.assertIsNone(cache.get(feed_cache.STATS_KEY.format('hits')))
+        self.assertEqual(feed_cache.stats(),
+                         {'hits': 2, 'misses': 1, 'stale': 0})
+        self.assertEqual(cache.get(feed_cache.STATS_KEY.format('hits')), 2)
+
+    def test_probabilistic_early_refresh(self):
+        key = feed_cache.FeedKey('feed:page:test', 'v1', 30)
+        feed_cache.get_or_render(key, self.render('старый'))
+        entry = cache.get(key.key)
+        entry['expires'] = time.time() + 1
+        entry['delta'] = 10
+        cache.set(key.key, entry)
+        with mock.patch('posts.feed_cache.random.random', return_value=0.5):
+            self.assertEqual(feed_cache.get_or_render(key, self.render()),
+                             'новый')
+        with mock.patch('posts.feed_cache.random.random', return_value=0.5):
+            self.assertEqual(feed_cache.get_or_render(key, self.render()),
+                             'новый')
+        self.assertEqual(self.renders, 2)
@@ -0,0 +1,275 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from PIL import features
+from sorl.thumbnail import base, default
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.storage import media_storage
+
+logger = logging.getLogger(__name__)
+
+# Ширины вариантов картинки поста, высота — в пропорции 960x339.
+# WebP создаётся, только если Pillow собран с его поддержкой
+WIDTHS = (480, 720, 960)
+FORMATS = ('WEBP', 'JPEG') if features.check('webp') else ('JPEG',)
+FALLBACK_FORMAT = 'JPEG'
+MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+SIZES = '(max-width: 960px) 100vw, 960px'
+
+# Все варианты (размер, опции sorl), которые создаёт generate
+GEOMETRIES = tuple(
+    (f'{width}x{round(width * 339 / 960)}',
+     {'crop': 'center', 'upscale': True, 'format': image_format})
+    for image_format in FORMATS for width in WIDTHS
+)
+
+# Метка «миниатюры этой картинки не создаются», живёт
+# THUMBNAIL_FAILURE_TIMEOUT секунд
+FAILED_KEY = 'thumbnail-failed:{}'
+
+_executor = None
+_executor_lock = threading.Lock()
+_queued = set()
+_local = threading.local()
+
+
+class ThumbnailBackend(base.ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, который при отрисовке не вызывает Pillow.
+
+    get_thumbnail только ищет готовую миниатюру в kvstore; если её нет,
+    ставит создание в фоновый пул и отдаёт исходную картинку, а
+    render_complete узнаёт, что страницу кэшировать рано. Создаёт
+    миниатюры generate — из пула и manage.py warm_thumbnails. Для
+    картинки, на которой generate упал, отдаётся исходная картинка
+    без повторной постановки в очередь, и страница кэшируется.
+    """
+
+    def _options(self, source, options):
+        # Те же умолчания, что в base.ThumbnailBackend.get_thumbnail,
+        # иначе имя файла миниатюры не совпадёт
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        """ImageFile миниатюры с её именем и ключом kvstore, без Pillow."""
+        source = ImageFile(file_)
+        options = self._options(source, options)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def lookup(self, file_, geometry_string, **options):
+        """Готовая миниатюра из kvstore или None, без обращения к Pillow."""
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options))
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        thumbnail = self.lookup(file_, geometry_string, **options)
+        if thumbnail is not None:
+            return thumbnail
+        return _missing(file_)
+
+    def generate(self, file_, geometry_string, **options):
+        return super().get_thumbnail(file_, geometry_string, **options)
+
+
+def _missing(file_):
+    name = file_.name if hasattr(file_, 'name') else file_
+    if not cache.get(FAILED_KEY.format(name)):
+        _local.missed = True
+        enqueue(name)
+    return ImageFile(file_)
+
+
+def _get_many(keys):
+    """Сырые значения kvstore по ключам: один get_many и один запрос.
+
+    Как cached_db_kvstore, запоминает в кэше и отсутствие записи.
+    """
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        found = {key: kvstore._get_raw(key) for key in keys}
+        return {key: value for key, value in found.items() if value}
+    found = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        rows = dict(KVStoreModel.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        fetched = {key: rows.get(key, cached_db_kvstore.EMPTY_VALUE)
+                   for key in missing}
+        kvstore.cache.set_many(
+            fetched, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(fetched)
+    return {key: value for key, value in found.items()
+            if value != cached_db_kvstore.EMPTY_VALUE}
+
+
+def resolve(posts):
+    """Находит миниатюры всех постов страницы разом.
+
+    Кладёт в post.thumbnails словарь {(размер, формат): ImageFile или
+    None} для каждого варианта из GEOMETRIES; шаблон собирает из них
+    <picture> фильтром picture без отдельных обращений к kvstore.
+    """
+    wanted = {}
+    for post in posts:
+        post.thumbnails = {}
+        if not post.image:
+            continue
+        for geometry, options in GEOMETRIES:
+            key = add_prefix(default.backend.thumbnail_file(
+                post.image, geometry, **options).key)
+            wanted.setdefault(key, []).append(
+                (post, (geometry, options['format'])))
+    found = _get_many(list(wanted)) if wanted else {}
+    for key, places in wanted.items():
+        value = found.get(key)
+        for post, variant in places:
+            post.thumbnails[variant] = (
+                deserialize_image_file(value) if value else None)
+
+
+def picture(post):
+    """Данные для <picture> картинки поста.
+
+    sources — srcset по форматам, кроме запасного JPEG; src, srcset,
+    width и height — для <img>. Пока готовы не все варианты, отдаёт
+    исходную картинку без srcset и ставит создание вариантов в очередь.
+    Без resolve варианты ищутся по одному.
+    """
+    if not hasattr(post, 'thumbnails'):
+        resolve([post])
+    if None in post.thumbnails.values():
+        return {'src': _missing(post.image), 'sources': [],
+                'srcset': '', 'sizes': '', 'width': None, 'height': None}
+    srcsets = {}
+    for (geometry, image_format), image in post.thumbnails.items():
+        srcsets.setdefault(image_format, []).append(
+            f'{image.url} {image.width}w')
+    largest = post.thumbnails[GEOMETRIES[-1][0], FALLBACK_FORMAT]
+    return {
+        'src': largest,
+        'sources': [{'type': MIME_TYPES[image_format],
+                     'srcset': ', '.join(srcset)}
+                    for image_format, srcset in srcsets.items()
+                    if image_format != FALLBACK_FORMAT],
+        'srcset': ', '.join(srcsets[FALLBACK_FORMAT]),
+        'sizes': SIZES,
+        'width': largest.width,
+        'height': largest.height,
+    }
+
+
+def render_complete(render):
+    """Вызывает render() и сообщает, были ли готовы все миниатюры.
+
+    Возвращает (результат, готово). Промах во вложенной отрисовке
+    (карточка внутри фрагмента ленты) виден и внешней.
+    """
+    outer = getattr(_local, 'missed', False)
+    _local.missed = False
+    try:
+        result = render()
+        complete = not _local.missed
+    finally:
+        _local.missed = outer or _local.missed
+    return result, complete
+
+
+def generate(name):
+    """Создаёт миниатюры всех размеров GEOMETRIES для картинки name."""
+    # Хранилище входит в ключ kvstore: оно должно совпадать с Post.image
+    source = ImageFile(name, media_storage)
+    for geometry, options in GEOMETRIES:
+        default.backend.generate(source, geometry, **options)
+
+
+def generate_in_thread(name):
+    """generate() для потока пула: потом закрывает его соединение с БД.
+
+    Картинка, из которой миниатюры не создаются (битый файл), помечается
+    в кэше, чтобы каждая отрисовка не ставила её в очередь заново.
+    """
+    try:
+        generate(name)
+    except Exception:
+        cache.set(FAILED_KEY.format(name), True,
+                  settings.THUMBNAIL_FAILURE_TIMEOUT)
+        raise
+    finally:
+        connection.close()
+
+
+def _work(name):
+    try:
+        generate_in_thread(name)
+    finally:
+        _queued.discard(name)
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS or 1,
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+def enqueue(name):
+    """Ставит создание миниатюр в пул после фиксации транзакции.
+
+    В очереди не больше THUMBNAIL_QUEUE задач; при переполнении задача
+    отбрасывается — картинку поставит в очередь следующая отрисовка
+    или manage.py warm_thumbnails. При THUMBNAIL_WORKERS = 0 фиксация
+    дожидается создания миниатюр.
+    """
+    transaction.on_commit(lambda: _submit(name))
+
+
+def _submit(name):
+    if not settings.THUMBNAIL_WORKERS:
+        # Ждём в этом же потоке, но запросы kvstore идут через соединение
+        # потока пула и не попадают в бюджет запроса
+        future = _pool().submit(generate_in_thread, name)
+        future.add_done_callback(_log_failure)
+        wait([future])
+        return
+    if name in _queued:
+        return
+    if len(_queued) >= settings.THUMBNAIL_QUEUE:
+        logger.warning('thumbnail queue is full, skipped %s', name)
+        return
+    _queued.add(name)
+    _pool().submit(_work, name).add_done_callback(_log_failure)
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('thumbnail generation failed',
+                     exc_info=future.exception())
+
+
+def warm(post):
+    """Ставит миниатюры картинки поста в очередь после сохранения."""
+    if post.image:
+        enqueue(post.image.name)
@@ -0,0 +1,232 @@
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q, Subquery
+
+from .models import (ArchivedPost, Follow, Post, TimelineEntry, UserStats,
+                     comment_count)
+from .paginator import FeedStream
+
+logger = logging.getLogger(__name__)
+
+
+def _entry(user_id, post):
+    return TimelineEntry(user_id=user_id, post_id=post.pk,
+                         author_id=post.author_id, pub_date=post.pub_date)
+
+
+def trim(user_id):
+    """Оставляет в ленте читателя не больше TIMELINE_MAX_ENTRIES строк."""
+    cap = settings.TIMELINE_MAX_ENTRIES
+    boundary = (TimelineEntry.objects.filter(user_id=user_id)
+                .values_list('pub_date', 'post_id')[cap:cap + 1])
+    if not boundary:
+        return
+    pub_date, post_id = boundary[0]
+    (TimelineEntry.objects.filter(user_id=user_id, pub_date__lte=pub_date)
+     .exclude(pub_date=pub_date, post_id__gt=post_id).delete())
+
+
+def trim_followers(author_id):
+    """trim() лент всех подписчиков автора одним запросом.
+
+    Строки за TIMELINE_MAX_ENTRIES нумеруются оконной функцией по
+    индексу (user, pub_date, post), без запроса на каждого читателя.
+    """
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+            f'PARTITION BY user_id ORDER BY pub_date DESC, post_id DESC'
+            f') AS position FROM {table} WHERE user_id IN ('
+            f'SELECT user_id FROM {Follow._meta.db_table} '
+            f'WHERE author_id = %s)) WHERE position > %s)',
+            [author_id, settings.TIMELINE_MAX_ENTRIES])
+
+
+def _pulled():
+    """Условие «посты автора подмешиваются при чтении».
+
+    Это авторы, у которых больше TIMELINE_FANOUT_THRESHOLD подписчиков,
+    и те, кто был выше порога, когда публиковал: их посты не разложены
+    по лентам, пока rebuild_timelines не снимет флаг pulled.
+    """
+    return (Q(followers_count__gt=settings.TIMELINE_FANOUT_THRESHOLD)
+            | Q(pulled=True))
+
+
+def pull_author_ids(user_id):
+    """Авторы из подписок читателя, чьи посты не раскладываются по лентам
+    и подмешиваются в ленту при чтении."""
+    return list(UserStats.objects.filter(
+        _pulled(), user__following__user_id=user_id,
+    ).values_list('user_id', flat=True))
+
+
+def is_pulled(author_id):
+    return UserStats.objects.filter(_pulled(), user_id=author_id).exists()
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора.
+
+    Возвращает id читателей, в ленты которых попал пост.
+    """
+    if is_pulled(post.author_id):
+        logger.debug('fan-out skipped for author %s: over %s followers',
+                     post.author_id, settings.TIMELINE_FANOUT_THRESHOLD)
+        # Пост не попал в ленты: автора читают при чтении, даже если
+        # подписчиков станет меньше порога
+        UserStats.objects.filter(user_id=post.author_id,
+                                 pulled=False).update(pulled=True)
+        return []
+    follower_ids = list(Follow.objects.filter(author_id=post.author_id)
+                        .values_list('user_id', flat=True))
+    TimelineEntry.objects.bulk_create(
+        [_entry(user_id, post) for user_id in follower_ids],
+        ignore_conflicts=True,
+    )
+    trim_followers(post.author_id)
+    return follower_ids
+
+
+def reader_ids(post):
+    """Читатели, в ленты подписок которых разложен пост автора."""
+    if is_pulled(post.author_id):
+        return []
+    return list(Follow.objects.filter(author_id=post.author_id)
+                .values_list('user_id', flat=True))
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя последние посты нового автора."""
+    if is_pulled(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).only(
+        'pk', 'author_id', 'pub_date')[:settings.TIMELINE_MAX_ENTRIES]
+    TimelineEntry.objects.bulk_create(
+        [_entry(user_id, post) for post in posts], ignore_conflicts=True)
+    trim(user_id)
+
+
+def release_pulled():
+    """Снимает флаг pulled с авторов ниже порога.
+
+    Только после rebuild всех лент: тогда их посты уже разложены.
+    """
+    return UserStats.objects.filter(
+        pulled=True,
+        followers_count__lte=settings.TIMELINE_FANOUT_THRESHOLD,
+    ).update(pulled=False)
+
+
+def drop_author(user_id, author_id):
+    """Убирает из ленты читателя посты автора, от которого он отписался."""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild(user_id):
+    """Пересобирает ленту читателя с нуля по его подпискам.
+
+    Авторы с флагом pulled, но ниже порога раскладываются: пока флаг
+    не снят, feed_streams всё равно читает их посты из таблицы постов.
+    """
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    popular = UserStats.objects.filter(
+        user__following__user_id=user_id,
+        followers_count__gt=settings.TIMELINE_FANOUT_THRESHOLD,
+    ).values_list('user_id', flat=True)
+    author_ids = (Follow.objects.filter(user_id=user_id)
+                  .exclude(author_id__in=list(popular))
+                  .values_list('author_id', flat=True))
+    posts = Post.objects.filter(author_id__in=list(author_ids)).only(
+        'pk', 'author_id', 'pub_date')[:settings.TIMELINE_MAX_ENTRIES]
+    TimelineEntry.objects.bulk_create(
+        [_entry(user_id, post) for post in posts])
+
+
+def _entry_post(entry):
+    entry.post.comment_count = entry.comment_count
+    return entry.post
+
+
+def _oldest_entry(user_id):
+    """Подзапросы даты и id самой старой строки ленты читателя."""
+    oldest = (TimelineEntry.objects.filter(user_id=user_id)
+              .order_by('pub_date', 'post_id'))
+    return (Subquery(oldest.values('pub_date')[:1]),
+            Subquery(oldest.values('post_id')[:1]))
+
+
+def feed_streams(user_id, pulled):
+    """Потоки ленты подписок: разложенные строки и посты «тяжёлых» авторов.
+
+    pulled — результат pull_author_ids(user_id). Посты «тяжёлых» авторов
+    здесь не старше самой старой строки ленты: дальше их вместе с
+    остальными авторами читает tail_stream, иначе лента выдала бы их
+    раньше более новых постов разложенных авторов.
+    """
+    logger.debug('follow feed for user %s: %s pulled authors (threshold %s)',
+                 user_id, len(pulled), settings.TIMELINE_FANOUT_THRESHOLD)
+    streams = [FeedStream(
+        TimelineEntry.objects.filter(user_id=user_id)
+        .exclude(author_id__in=pulled)
+        .select_related('post__author', 'post__group')
+        .annotate(comment_count=comment_count('post_id')),
+        ('pub_date', 'post_id'),
+        _entry_post,
+    )]
+    if pulled:
+        oldest_date, oldest_id = _oldest_entry(user_id)
+        # Пустая лента ничего не ограничивает
+        has_entries = Exists(TimelineEntry.objects.filter(user_id=user_id))
+        streams.append(FeedStream(
+            Post.objects.for_feed().filter(author_id__in=pulled)
+            .annotate(has_entries=has_entries)
+            .filter(Q(has_entries=False)
+                    | Q(pub_date__gt=oldest_date)
+                    | Q(pub_date=oldest_date, pk__gte=oldest_id)),
+            ('pub_date', 'pk'),
+            lambda post: post,
+        ))
+    return streams
+
+
+def tail_stream(user_id):
+    """Горячие посты из подписок старше самой старой строки ленты.
+
+    Лента хранит только TIMELINE_MAX_ENTRIES строк: когда они кончились,
+    лента продолжается постами всех авторов из таблицы постов и только
+    потом архивом. Граница та же, что у потока «тяжёлых» авторов в
+    feed_streams, поэтому с основными потоками этот не пересекается.
+    """
+    oldest_date, oldest_id = _oldest_entry(user_id)
+    followed = Follow.objects.filter(user_id=user_id,
+                                     author_id=OuterRef('author_id'))
+    return FeedStream(
+        Post.objects.for_feed()
+        .annotate(followed=Exists(followed)).filter(followed=True)
+        .filter(Q(pub_date__lt=oldest_date)
+                | Q(pub_date=oldest_date, pk__lt=oldest_id)),
+        ('pub_date', 'pk'),
+        lambda post: post,
+    )
+
+
+def archive_stream(user_id):
+    """Архивные посты авторов из подписок: лента продолжается в них,
+    когда разложенные строки кончились.
+
+    Подписка проверяется коррелированным EXISTS, а не IN по авторам:
+    так архив читается по индексу даты без сортировки.
+    """
+    followed = Follow.objects.filter(user_id=user_id,
+                                     author_id=OuterRef('author_id'))
+    return FeedStream(
+        ArchivedPost.objects.for_feed()
+        .annotate(followed=Exists(followed)).filter(followed=True),
+        ('pub_date', 'pk'),
+        lambda post: post,
+    )
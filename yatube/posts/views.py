@@ -1,71 +1,153 @@
+from urllib.parse import urlencode
+
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Follow, Post, Group, User, Comment
+from .models import ArchivedPost, Follow, Post, Group, User
+from .feed_cache import conditional, page_key, page_scopes
 from .forms import PostForm
-from django.core.paginator import Paginator
+from .page_cache import cache_anonymous, tag
+from .paginator import MergedCursorPaginator, SearchPaginator, paginate
+from .search import build_match
+from .stats import stats_for
+from .thumbnails import resolve
+from .timeline import (archive_stream, feed_streams, pull_author_ids,
+                       tail_stream)
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_GET
+from core.db_router import read_replica
+from core.query_budget import query_budget
 from .forms import PostForm, CommentForm
 
 
+def group_scopes(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    if group_id is not None:
+        return [f'group:{group_id}', f'comments:group:{group_id}']
+
+
+def profile_scopes(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is not None:
+        return [f'author:{author_id}', f'profile:{author_id}',
+                f'comments:author:{author_id}']
+
+
+def post_scopes(request, post_id):
+    author_id = Post.objects.filter(pk=post_id).values_list(
+        'author_id', flat=True).first()
+    if author_id is None:
+        author_id = ArchivedPost.objects.filter(pk=post_id).values_list(
+            'author_id', flat=True).first()
+    if author_id is not None:
+        return [f'post:{post_id}', f'author:{author_id}']
+
+
 @require_GET
+@conditional(lambda request: ['global', 'comments:global'])
+@cache_anonymous
+@read_replica
+@query_budget(5)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    page_obj = paginate(request, post_list,
+                        archive=ArchivedPost.objects.for_feed())
+    scopes = ['global', *page_scopes(page_obj)]
+    tag(request, *scopes)
     context = {
         'page_obj': page_obj,
         'posts': post_list,
+        'feed_key': page_key(request, scopes),
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional(group_scopes)
+@cache_anonymous
+@read_replica
+@query_budget(7)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all().order_by('-pub_date')
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = group.posts.for_feed()
+    page_obj = paginate(request, post_list,
+                        archive=group.archived_posts.for_feed())
+    scopes = [f'group:{group.pk}', *page_scopes(page_obj)]
+    tag(request, *scopes)
     context = {
         'page_obj': page_obj,
         'group': group,
         'posts': post_list,
+        'feed_key': page_key(request, scopes),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@conditional(profile_scopes)
+@cache_anonymous
+@read_replica
+@query_budget(8)
 def profile(request, username):
-    author = User.objects.get(username=username)
-    author_post = Post.objects.filter(author=author).order_by('-pub_date')
-    posts_numbers = author_post.count()
-    paginator = Paginator(author_post, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    following = author.following.all()
-    follower = author.follower.all()
-    count_follower = follower.count()
-    count_following = following.count()
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    stats = stats_for(author)
+    author_post = Post.objects.for_feed().filter(author=author)
+    page_obj = paginate(request, author_post,
+                        archive=author.archived_posts.for_feed())
+    following = (
+        request.user.is_authenticated
+        and Follow.objects.filter(user=request.user, author=author).exists()
+    )
+    scopes = [f'author:{author.pk}', *page_scopes(page_obj)]
+    tag(request, f'profile:{author.pk}', *scopes)
     context = {
         'page_obj': page_obj,
         'author': author,
         'author_post': author_post,
-        'posts_numbers': posts_numbers,
-        'count_following': count_following,
-        'count_follower': count_follower,
-        'following': following}
+        'posts_numbers': stats.posts_count,
+        'count_following': stats.followers_count,
+        'count_follower': stats.following_count,
+        'following': following,
+        'feed_key': page_key(request, scopes)}
     return render(request, 'posts/profile.html', context)
 
 
+@require_GET
+@query_budget(4)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    match = build_match(query)
+    page_obj = None
+    if match:
+        paginator = SearchPaginator(
+            match, Post.objects.for_feed(),
+            archive=ArchivedPost.objects.for_feed())
+        page_obj = paginator.get_page(request.GET)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_params': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@conditional(post_scopes)
+@cache_anonymous
+@read_replica
+@query_budget(7)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    author_posts = post.author.posts.count()
-    num_author_posts = Post.objects.filter(author=author_posts).count()
+    # Старые посты лежат в архиве под тем же id
+    post = (Post.objects.select_related('author__stats', 'group')
+            .filter(id=post_id).first()
+            or get_object_or_404(ArchivedPost.objects.select_related(
+                'author__stats', 'group'), id=post_id))
+    tag(request, *page_scopes([post]))
+    resolve([post])
+    post_number = stats_for(post.author).posts_count
     comment_form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post=post)
+    comments = post.comments.select_related('author')
     context = {
         'post': post,
-        'author_posts': author_posts,
-        'posts_count': num_author_posts,
+        'post_number': post_number,
         'form': comment_form,
         'comments': comments,
     }
@@ -73,6 +155,7 @@ def post_detail(request, post_id):
 
 
 @login_required
+@query_budget(13)
 def post_create(request):
     form = PostForm(request.POST or None,
                     files=request.FILES or None)
@@ -85,6 +168,7 @@ def post_create(request):
 
 
 @login_required
+@query_budget(14)
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if post.author != request.user:
@@ -100,6 +184,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@query_budget(6)
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -112,16 +197,23 @@ def add_comment(request, post_id):
 
 
 @login_required
+@read_replica
+@query_budget(9)
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    context = {'page_obj': page}
+    pulled = pull_author_ids(request.user.pk)
+    paginator = MergedCursorPaginator(
+        feed_streams(request.user.pk, pulled),
+        archive=[tail_stream(request.user.pk),
+                 archive_stream(request.user.pk)])
+    page = paginator.get_page(request.GET)
+    scopes = [f'follow:{request.user.pk}', *page_scopes(page)]
+    scopes += [f'author:{author_id}' for author_id in pulled]
+    context = {'page_obj': page, 'feed_key': page_key(request, scopes)}
     return render(request, "posts/follow.html", context)
 
 
 @login_required
+@query_budget(14)
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
@@ -133,6 +225,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@query_budget(10)
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(author=author, user=request.user).delete()
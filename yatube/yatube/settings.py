@@ -8,6 +8,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -22,6 +23,9 @@ SECRET_KEY = '5@(w3f17png_qyiyb6oesd=qjd(b2o&^zuv1#r_%r+)qkn74z9'
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# Запуск под manage.py test или pytest
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+
 ALLOWED_HOSTS = [
     'localhost',
     '127.0.0.1',
@@ -46,11 +50,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.staticfiles.StaticFilesMiddleware',
+    'core.staticfiles.PreloadLinkMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.db_router.ReplicaMiddleware',
+    'posts.page_cache.AnonymousPageCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -89,7 +98,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # Соединение живёт между запросами потока, а не открывается
+        # заново на каждый
+        'CONN_MAX_AGE': 600,
+    },
+    # Копия для чтения, её обновляет manage.py sync_replica
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+# Читающие view с @read_replica ходят в реплику (core.db_router), если
+# она включена явно (YATUBE_REPLICA_READS=1) и миграции в ней те же, что
+# в основной базе; после записи сессия REPLICA_PIN_SECONDS секунд
+# читает с основной базы, чтобы видеть свои изменения
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICA = 'replica'
+REPLICA_READS = (not TESTING
+                 and os.environ.get('YATUBE_REPLICA_READS') == '1')
+REPLICA_PIN_SECONDS = 5
+REPLICA_SCHEMA_CHECK_SECONDS = 30
+
+# Профиль SQLite для каждого соединения (core.signals): в WAL читатели
+# не ждут пишущего, запись ждёт занятую базу до busy_timeout мс, а не
+# падает сразу с «database is locked»
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -133,6 +175,17 @@ STATIC_URL = '/static/'
 
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 
+# collectstatic даёт файлам хеш в имени и кладёт рядом .gz (и .br, если
+# установлен brotli); core.staticfiles.StaticFilesMiddleware отдаёт их
+# с кэшированием на год
+STATIC_ROOT = os.path.join(BASE_DIR, 'static_collected')
+STATICFILES_STORAGE = 'core.staticfiles.CompressedManifestStaticFilesStorage'
+
+# Статика, которую браузер грузит по заголовку Link: preload
+STATIC_PRELOAD = [
+    ('css/bootstrap.min.css', 'style'),
+]
+
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
@@ -142,8 +195,81 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Один кэш на все WSGI-воркеры хоста: файл SQLite в режиме WAL.
+# Тесты берут кэш в памяти, чтобы не делить файл между прогонами
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
+    }
+}
+
+if TESTING:
+    CACHES['default'] = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
+
+# Сколько последних постов хранится в материализованной ленте подписок
+TIMELINE_MAX_ENTRIES = 1000
+
+# Авторы с большим числом подписчиков не раскладываются по лентам,
+# их посты подмешиваются в ленту подписок при чтении
+TIMELINE_FANOUT_THRESHOLD = 10000
+
+# Посты старше ARCHIVE_AFTER_DAYS дней manage.py archive_posts переносит
+# в архивные таблицы по ARCHIVE_BATCH за транзакцию: горячая таблица
+# и её индексы остаются небольшими и держатся в кэше
+ARCHIVE_AFTER_DAYS = 180
+ARCHIVE_BATCH = 500
+
+# Время жизни отрисованных страниц лент; устаревание — через поколения
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Счётчики попаданий кэша лент копятся в процессе и переносятся в кэш
+# раз в FEED_CACHE_STATS_FLUSH секунд
+FEED_CACHE_STATS_FLUSH = 10
+
+# Окно stale-while-revalidate по видам областей, секунды: пока один
+# запрос пересчитывает фрагмент ленты, остальные отдают старую копию
+FEED_CACHE_STALE = {
+    'global': 30,
+    'group': 60,
+    'author': 60,
+    'follow': 10,
 }
+
+# Миниатюры создаются фоновым пулом (posts.thumbnails), а не при
+# отрисовке шаблона; THUMBNAIL_QUEUE — предел ждущих задач
+THUMBNAIL_BACKEND = 'posts.thumbnails.ThumbnailBackend'
+# В тестах миниатюры создаются сразу: фоновый поток не должен писать
+# во временный MEDIA_ROOT, который тест уже удаляет
+THUMBNAIL_WORKERS = 0 if TESTING else 2
+THUMBNAIL_QUEUE = 200
+# Столько секунд картинка, на которой создание миниатюр упало,
+# показывается как есть и не ставится в очередь снова
+THUMBNAIL_FAILURE_TIMEOUT = 60 * 60
+
+# Загрузки пишутся на диск потоком. Картинка поста (posts.ingest)
+# отклоняется больше IMAGE_UPLOAD_MAX_BYTES или IMAGE_MAX_PIXELS по
+# заголовку, уменьшается до IMAGE_MAX_SIDE; на декодирование одной
+# картинки уходит не больше IMAGE_DECODE_MEMORY байт
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+IMAGE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_MAX_PIXELS = 50 * 10 ** 6
+IMAGE_MAX_SIDE = 2560
+IMAGE_DECODE_MEMORY = 64 * 1024 * 1024
+
+# Страницы для анонимов вычищаются сигналами, срок — лишь страховка
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Превышение бюджета SQL-запросов view (@query_budget) — ошибка в тестах
+# и при YATUBE_QUERY_BUDGET_RAISE=1, по умолчанию только запись в лог:
+# DEBUG здесь ни при чём, он включён и на сервере
+QUERY_BUDGET_RAISE = (TESTING
+                      or os.environ.get('YATUBE_QUERY_BUDGET_RAISE') == '1')